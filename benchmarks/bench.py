@@ -0,0 +1,299 @@
+#!/usr/bin/python
+#
+# bench.py - Offline benchmarks for the USB, download and OTA hot paths
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Everything runs against local stand-ins: the emulated Dash from
+# libs/dashemulator.py for USB, and a local HTTP server for version.json
+# and the device list API. Results are compared with baseline.json (next
+# to this script) and the run fails if anything got slower than the
+# allowed tolerance. Timings only compare on the machine that made them,
+# so baseline.json is ignored by git.
+#
+# Every sample times as many calls as take MIN_SAMPLE_TIME, and results
+# are the median sample. A result only counts as a regression when it is
+# slower by more than the tolerance and by more than NOISE_FACTOR times
+# the spread between samples, so noisy benchmarks don't fail the run.
+#
+# python benchmarks/bench.py                  run and compare
+# python benchmarks/bench.py --save-baseline  run and store a new baseline
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from timeit import default_timer as timer
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.framing import ReportFramer
+from libs.usbupdater import USBUpdater, DashVersion
+from libs.dashemulator import EmulatorBackend, EmulatedDash
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+MIN_SAMPLE_TIME = 0.2
+NOISE_FACTOR = 3
+
+class Result:
+    def __init__(self, name, value, unit, higher_is_better, spread=0.0):
+        self.name = name
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+        self.spread = spread
+
+    def as_dict(self):
+        return {'value': self.value, 'unit': self.unit,
+                'higher_is_better': self.higher_is_better,
+                'spread': self.spread}
+
+def time_calls(fn, number):
+    start = timer()
+    for i in xrange(number):
+        fn()
+    return timer() - start
+
+def measure(repeat, fn):
+    '''Times repeat samples of fn, each of as many calls as take at least
+    MIN_SAMPLE_TIME, like timeit's autorange.
+
+    returns (median seconds per call, spread), the spread being half the
+    range of the samples relative to the median
+    '''
+    number = 1
+    while True:
+        elapsed = time_calls(fn, number)
+        if elapsed >= MIN_SAMPLE_TIME:
+            break
+        number *= 2
+    # The call count was settled on by a sample long enough to keep
+    samples = [elapsed / number]
+    for i in xrange(repeat - 1):
+        samples.append(time_calls(fn, number) / number)
+    samples.sort()
+    middle = len(samples) / 2
+    if len(samples) % 2:
+        median = samples[middle]
+    else:
+        median = (samples[middle - 1] + samples[middle]) / 2
+    return median, (samples[-1] - samples[0]) / median / 2
+
+def bench_framing(repeat):
+    results = []
+    image = os.urandom(256 * 1024)
+    blocks = [buffer(image, i, 1024) for i in xrange(0, len(image), 1024)]
+    for vid in (0x7722, 0x2cf3):
+        framer = ReportFramer(vid)
+        def frame():
+            for block_id, kb in enumerate(blocks):
+                framer.frame(kb, 0x18, block_id)
+        elapsed, spread = measure(repeat, frame)
+        results.append(Result('framing_%04x_MBps' % vid,
+            len(image) / elapsed / 1e6, 'MB/s', True, spread))
+    return results
+
+def bench_flash(repeat):
+    results = []
+    for kb in (16, 64, 256, 1024):
+        image = os.urandom(kb * 1024)
+        backend = EmulatorBackend([EmulatedDash()])
+        updater = USBUpdater(0x2cf3, 0x1100)
+        updater.set_backend(backend)
+        elapsed, spread = measure(repeat,
+                lambda: updater.memory_update(image, 0x3C))
+        results.append(Result('flash_%dKB_ms' % kb, elapsed * 1000, 'ms',
+            False, spread))
+    return results
+
+def bench_version_compare(repeat):
+    versions = [DashVersion(i % 3, i % 7, i % 11) for i in xrange(1000)]
+    target = DashVersion(1, 3, 5)
+    def compare():
+        for i in xrange(100):
+            [v for v in versions if v < target]
+    elapsed, spread = measure(repeat, compare)
+    return [Result('version_compare_us', elapsed / 100000 * 1e6, 'us', False,
+        spread)]
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    '''Serves version.json and a paginated device list like the real API'''
+    # Keep connections alive like the real API does
+    protocol_version = 'HTTP/1.1'
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(url.query)
+        if url.path.endswith('/version.json'):
+            self.send_json(json.dumps({
+                'system_firmware_version': '0.9.2',
+                'system_firmware_location': 'system_',
+                'boot_version': '0.9.1',
+                'boot_location': 'boot_'}))
+        elif url.path.endswith('/devices/'):
+            limit = int(params.get('limit', ['1000'])[0])
+            startafter = int(params.get('startafter', ['0'])[0])
+            count = self.server.device_count
+            ids = xrange(startafter + 1, min(startafter + limit, count) + 1)
+            self.send_json(json.dumps({'success': True, 'data': [
+                {'id': i, 'name': 'device %d' % i, 'orgid': 1} for i in ids]}))
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+class StubAPIServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    device_count = 0
+
+def start_server():
+    server = StubAPIServer(('127.0.0.1', 0), StubAPIHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+def bench_version_check(repeat, base):
+    from dashupdater import DashUpdater
+    updater = DashUpdater('bench')
+    updater.set_update_url(base + '/dash/system_firmware')
+    # Every run goes to the server instead of the manifest cache
+    updater.set_use_cache(False)
+    elapsed, spread = measure(repeat, updater.fetch_download_versions)
+    return [Result('version_check_ms', elapsed * 1000, 'ms', False, spread)]
+
+def bench_device_list(repeat, server, base):
+    from libs.otaupdater import OTAUpdater
+    results = []
+    for count in (10000, 100000):
+        server.device_count = count
+        updater = OTAUpdater(None)
+        updater.set_apibase(base + '/api/1/')
+        updater.set_apikey('bench')
+        elapsed, spread = measure(repeat, lambda: updater.load_devices(1))
+        results.append(Result('load_devices_%dk_ms' % (count / 1000),
+            elapsed * 1000, 'ms', False, spread))
+    return results
+
+def run(repeat):
+    results = []
+    results += bench_framing(repeat)
+    results += bench_flash(repeat)
+    results += bench_version_compare(repeat)
+    if requests is None:
+        print 'requests is not installed, skipping the HTTP benchmarks'
+    else:
+        server, base = start_server()
+        try:
+            results += bench_version_check(repeat, base)
+            results += bench_device_list(max(repeat / 2, 3), server, base)
+        finally:
+            # Drop the kept-alive connections so the handlers can exit
+            from libs.httpclient import get_default_client
+            get_default_client().close()
+            server.shutdown()
+    return results
+
+def compare(results, baseline, tolerance):
+    '''Prints every result against the baseline and returns the names of
+    the ones that regressed by more than tolerance (a fraction) and by more
+    than the noise seen in either run
+    '''
+    regressions = []
+    for r in results:
+        line = '%-24s %12.3f %-5s +-%4.1f%%' % (r.name, r.value, r.unit,
+                r.spread * 100)
+        base = baseline.get(r.name)
+        if base and base['value']:
+            change = (r.value - base['value']) / base['value']
+            if not r.higher_is_better:
+                change = -change
+            allowed = max(tolerance,
+                    NOISE_FACTOR * max(r.spread, base.get('spread', 0)))
+            line += '  %+6.1f%% vs baseline (allowed -%.1f%%)' % (
+                    change * 100, allowed * 100)
+            if change < -allowed:
+                line += '  REGRESSION'
+                regressions.append(r.name)
+        print line
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='Benchmark the USB, download and OTA hot paths')
+    parser.add_argument('--repeat', type=int, default=5)
+    # Whole runs drift against each other by tens of percent on shared
+    # machines, more than the spread within a run shows
+    parser.add_argument('--tolerance', type=float, default=0.5,
+        help="Allowed slowdown against the baseline, as a fraction")
+    parser.add_argument('--baseline', type=str, default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    # Keep whatever the benchmarks cache out of the user's ~/.dashupdater
+    cache = tempfile.mkdtemp(prefix='dashbench')
+    os.environ['DASHUPDATER_CACHE'] = cache
+    try:
+        results = run(args.repeat)
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline or not baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(dict((r.name, r.as_dict()) for r in results), f,
+                    indent=2, sort_keys=True)
+        print 'Baseline saved to', args.baseline
+    elif regressions:
+        print 'Regressed:', ', '.join(regressions)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
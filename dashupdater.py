@@ -27,16 +27,33 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from libs.usbupdater import USBUpdater, DashVersion, DashVersions
-from libs.otaupdater import OTAUpdater
+from libs.usbupdater import DashVersions
+from libs.gangflash import GangFlasher
+from libs.discovery import DeviceIndex, DASH_MODES
+from libs.flashledger import FlashLedger
+from libs.imagesource import ImageSource
+from libs.usbmetrics import FlashMetrics
+from libs.firmwarecache import FirmwareCache
+from libs.download import download, SYSTEM_HEADER
+from libs.prefetch import Prefetch
+from libs.httpclient import HTTPClient, set_default_client
+from libs.manifest import FirmwareManifest, ManifestCache, DeviceVersionRecord
+from libs.bundle import FirmwareBundle, write_bundle
+from libs.hidbackend import set_default_backend
+from libs.dashemulator import EmulatorBackend, EmulatedDash
+from libs.otaupdater import OTAUpdater, read_device_list, filter_devices
+from libs.uploadindex import UploadIndex
+from libs.fleetcache import FleetCache
 from libs.updatergui import UpdaterGUI
 from libs.updatertextui import UpdaterTextUI
 from libs.kexceptions import *
 
 import argparse
+import itertools
 import os
+import sqlite3
 import sys
-import requests
+import threading
 
 class DashUpdater:
     pid = 0x1100
@@ -55,8 +72,32 @@ class DashUpdater:
     download_boot_version = None
     download_boot_url = None
     check_update = True
+    gang = False
+    incremental = False
+    sparse = False
+    reset_poll = True
+    metrics_file = None
+    retries = None
+    pipeline_depth = 0
+    use_cache = True
+    firmware_cache = None
+    manifest_cache = None
+    manifest_ttl = 3600
+    device_record = None
+    prefetch = None
+    bundle_file = None
+    bundle = None
+    all_devices = False
+    device_list_file = None
+    batch_size = None
+    resync = False
+    device = None
     def __init__(self, version):
         self.version = version
+        self.prefetched = {}
+        self.prefetch_lock = threading.Lock()
+        self.prefetch_cancel = threading.Event()
+        self.device_filters = []
     def set_vid(self, vid):
         self.vid = vid
     def set_pid(self, pid):
@@ -81,24 +122,51 @@ class DashUpdater:
         self.update_url = update_url
     def set_check_update(self, check_update):
         self.check_update = check_update
+    def set_gang(self, gang):
+        self.gang = gang
+    def set_incremental(self, incremental):
+        self.incremental = incremental
+    def set_sparse(self, sparse):
+        self.sparse = sparse
+    def set_reset_poll(self, reset_poll):
+        self.reset_poll = reset_poll
+    def set_metrics_file(self, metrics_file):
+        self.metrics_file = metrics_file
+    def set_retries(self, retries):
+        self.retries = retries
+    def set_pipeline_depth(self, pipeline_depth):
+        self.pipeline_depth = pipeline_depth
+    def set_use_cache(self, use_cache):
+        self.use_cache = use_cache
+    def set_manifest_ttl(self, manifest_ttl):
+        self.manifest_ttl = manifest_ttl
+    def set_bundle_file(self, bundle_file):
+        self.bundle_file = bundle_file
+    def set_all_devices(self, all_devices):
+        self.all_devices = all_devices
+    def set_device_list_file(self, device_list_file):
+        self.device_list_file = device_list_file
+    def set_device_filters(self, device_filters):
+        self.device_filters = device_filters
+    def set_batch_size(self, batch_size):
+        self.batch_size = batch_size
+    def set_resync(self, resync):
+        self.resync = resync
+    def set_device(self, device):
+        self.device = device
 
     def validate_file(self, offset, id, filename):
         valid = False
         if filename is None:
             filename = self.imagefile
-        try:
-            with open(filename, 'r') as f:
-                f.seek(offset)
-                fid = f.read(len(id))
-                if fid == id:
-                    valid = True
-        except IOError:
-            raise
+        with ImageSource.fromfile(filename) as source:
+            if source.read(offset, len(id)) == id:
+                valid = True
         return valid
 
     def validate_memory(self, offset, id, memory):
         try:
-            tag = memory[offset:offset+len(id)]
+            tag = ImageSource.wrap(memory).read(offset, len(id))
             return tag == id
         except:
             pass
@@ -127,7 +195,9 @@ class DashUpdater:
             raise KonektException('Invalid Image File')
 
     def finish_update(self, ui):
-        if self.method == 'usb':
+        if self.method == 'usb' and self.gang:
+            self.finish_update_gang(ui)
+        elif self.method == 'usb':
             self.finish_update_usb(ui)
         elif self.method == 'ota':
             self.finish_update_ota(ui)
@@ -139,29 +209,138 @@ class DashUpdater:
         updater = OTAUpdater(self.imagefile)
         if self.apibase:
             updater.set_apibase(self.apibase)
+        if self.use_cache:
+            try:
+                updater.set_upload_index(UploadIndex(updater.apibase,
+                    debug=self.debug))
+            except (IOError, OSError) as e:
+                if self.debug: print 'upload index unavailable:', e
         if not self.apikey:
             self.apikey = ui.prompt_for_apikey()
             if not self.apikey:
                 raise MissingParamException('apikey')
         updater.set_apikey(self.apikey)
-        if not self.orgid:
-            orgs = updater.get_orgs()
+        fleet = self.get_fleet_cache(updater)
+        try:
+            self.push_ota(ui, updater, fleet)
+        finally:
+            fleet.close()
+
+    def get_fleet_cache(self, updater):
+        if self.use_cache:
+            try:
+                return FleetCache.for_account(updater.apibase, self.apikey,
+                        debug=self.debug)
+            except (IOError, OSError, sqlite3.Error) as e:
+                if self.debug: print 'fleet cache unavailable:', e
+        # Nothing is kept, every listing is fetched in full
+        return FleetCache(':memory:', debug=self.debug)
+
+    def push_ota(self, ui, updater, fleet):
+        orgid = self.orgid
+        if self.device:
+            self.deviceid, orgid = self.lookup_device(updater, fleet, orgid)
+        elif self.deviceid and not orgid:
+            found = fleet.find_device(self.deviceid)
+            if found is not None:
+                orgid = found[0]
+        if not orgid:
+            orgs = fleet.orgs(updater, self.resync)
             if len(orgs) == 1:
                 orgid = orgs[0]['id']
             else:
                 orgid = ui.prompt_for_orgid(orgs)
+        if self.is_bulk_update():
+            self.finish_update_ota_bulk(ui, updater, fleet, orgid)
+            return
         if not self.deviceid:
             if orgid is None or not orgid:
                 raise MissingParamException('orgid')
-            devices = updater.get_device_list(orgid)
-            if not devices:
-                raise KonektException("You have no devices in your account")
-            self.deviceid = ui.prompt_for_deviceid(devices)
+            # The prompt can start on the first page while the rest load
+            devices = fleet.devices(updater, orgid, self.resync)
+            try:
+                first = next(devices, None)
+                if first is None:
+                    raise KonektException("You have no devices in your account")
+                self.deviceid = ui.prompt_for_deviceid(
+                        itertools.chain([first], devices))
+            finally:
+                devices.close()
             if not self.deviceid:
                 raise MissingParamException('deviceid')
         updater.update(self.deviceid, orgid)
 
 
+    def lookup_device(self, updater, fleet, orgid):
+        '''(deviceid, orgid) of the device named or with the IMEI given by
+        --device, refreshing the cached devices if it isn't known yet'''
+        def search():
+            found = fleet.find_devices('name', self.device) + \
+                    fleet.find_devices('imei', self.device)
+            return [(parent, device) for parent, device in found
+                    if not orgid or parent == orgid]
+        found = search()
+        if not found:
+            if orgid:
+                orgids = [orgid]
+            else:
+                orgids = [org['id'] for org in fleet.orgs(updater, self.resync)]
+            for refresh_orgid in orgids:
+                fleet.refresh_devices(updater, refresh_orgid, self.resync)
+            found = search()
+        if not found:
+            raise KonektException("No device named or with the IMEI " +
+                    self.device)
+        if len(found) > 1:
+            raise KonektException("%d devices match %s, use --deviceid" %
+                    (len(found), self.device))
+        parent, device = found[0]
+        return device['id'], parent
+
+    def is_bulk_update(self):
+        return bool(self.all_devices or self.device_list_file or
+                self.device_filters)
+
+    def select_bulk_devices(self, updater, fleet, orgid):
+        '''Device IDs picked by --all-devices, --device-list and --filter'''
+        deviceids = None
+        if self.device_list_file:
+            try:
+                deviceids = read_device_list(self.device_list_file)
+            except UpdaterException as e:
+                raise KonektException(str(e))
+        if self.all_devices or self.device_filters:
+            if orgid is None or not orgid:
+                raise MissingParamException('orgid')
+            devices = fleet.devices(updater, orgid, self.resync)
+            try:
+                devices = filter_devices(devices, self.device_filters)
+            except UpdaterException as e:
+                raise KonektException(str(e))
+            selected = [device['id'] for device in devices]
+            if deviceids is not None:
+                listed = set(deviceids)
+                selected = [deviceid for deviceid in selected
+                        if deviceid in listed]
+            deviceids = selected
+        return deviceids
+
+    def finish_update_ota_bulk(self, ui, updater, fleet, orgid):
+        deviceids = self.select_bulk_devices(updater, fleet, orgid)
+        if not deviceids:
+            raise KonektException("No devices matched")
+        if self.batch_size:
+            results = updater.bulk_update(deviceids, orgid, self.batch_size)
+        else:
+            results = updater.bulk_update(deviceids, orgid)
+        failed = [result for result in results if not result.ok()]
+        if failed:
+            raise KonektException("%d of %d batches failed (%d devices):\n%s"
+                    % (len(failed), len(results),
+                        sum(len(result.deviceids) for result in failed),
+                        '\n'.join('Batch %d: %s' % (result.number, result)
+                            for result in failed)))
+
     def exception_usb_update(self):
         raise KonektException( ("Error updating over USB.\n"
                     "Is the correct Dash connected and did you push the "
@@ -177,110 +356,331 @@ class DashUpdater:
                     "community.hologram.io if you need help") )
 
 
-    def download_firmware(self, url):
+    def get_firmware_cache(self):
+        if self.firmware_cache is None and self.use_cache:
+            try:
+                self.firmware_cache = FirmwareCache(debug=self.debug)
+            except (IOError, OSError) as e:
+                if self.debug: print 'firmware cache unavailable:', e
+                self.use_cache = False
+        return self.firmware_cache
+
+    def get_bundle(self):
+        if self.bundle is None:
+            try:
+                self.bundle = FirmwareBundle(self.bundle_file, debug=self.debug)
+            except UpdaterException as e:
+                raise KonektException(str(e))
+        return self.bundle
+
+    def make_bundle(self, filename):
+        '''Download the current release from the update URL into a bundle
+        for stations without network access'''
+        if not self.fetch_download_versions():
+            self.download_exception()
+        boot_firmware = self.download_firmware(self.download_boot_url)
+        system_firmware = self.download_firmware(self.download_firmware_url)
+        try:
+            if boot_firmware is None or system_firmware is None:
+                self.download_exception()
+            manifest = FirmwareManifest(self.download_firmware_version,
+                    self.download_firmware_url, self.download_boot_version,
+                    self.download_boot_url)
+            write_bundle(filename, manifest,
+                    {'boot': boot_firmware, 'system': system_firmware})
+        finally:
+            for source in (boot_firmware, system_firmware):
+                if source is not None:
+                    source.close()
+
+    def download_firmware(self, url, cancel=None):
+        '''Streams url to disk and returns it as an ImageSource, or None if
+        it can't be downloaded, isn't a system image or cancel was set.
+        With a bundle, url is the name of an image in it'''
         if url is None:
             return None
-        r = requests.get(url)
-        if r.ok:
-            if self.debug:
-                print 'successful download of ', url, ' ', len(r.content), 'bytes'
-            return r.content
-        return None
+        if self.bundle_file is not None:
+            try:
+                return self.get_bundle().image(url)
+            except UpdaterException as e:
+                raise KonektException(str(e))
+        try:
+            cache = self.get_firmware_cache()
+            if cache is not None:
+                source = cache.fetch_source(url, SYSTEM_HEADER, cancel)
+            else:
+                source = download(url, SYSTEM_HEADER, debug=self.debug,
+                        cancel=cancel)
+        except UpdaterException as e:
+            if self.debug: print 'download_firmware:', e
+            return None
+        if self.debug and source is not None:
+            print 'firmware for', url, len(source), 'bytes'
+        return source
+
+    def start_prefetch(self):
+        '''Fetch the manifest in the background, so it is ready by the
+        time the device has been found and asked for its versions'''
+        if self.imagetype == 'user' and self.check_update and \
+                self.bundle_file is None:
+            with self.prefetch_lock:
+                self.prefetch_cancel = threading.Event()
+            self.prefetch = Prefetch(self.fetch_download_versions)
+
+    def prefetch_firmware(self, *urls):
+        '''Start downloading the images an upgrade needs, so they arrive
+        while the user is asked about it'''
+        if self.prefetch is None:
+            return
+        with self.prefetch_lock:
+            if self.prefetch_cancel.is_set():
+                return
+            for url in urls:
+                if url not in self.prefetched:
+                    self.prefetched[url] = Prefetch(self.download_firmware,
+                            url, self.prefetch_cancel)
+
+    def wait_for_manifest(self):
+        if self.prefetch is None:
+            return self.fetch_download_versions()
+        return self.prefetch.result()
+
+    def get_firmware(self, url):
+        '''The prefetched image for url, or a fresh download'''
+        with self.prefetch_lock:
+            prefetch = self.prefetched.pop(url, None)
+        if prefetch is None:
+            return self.download_firmware(url)
+        return prefetch.result()
+
+    def discard_prefetch(self):
+        # Stop the downloads that turned out not to be needed rather than
+        # wait for them; whatever still arrives is closed by its worker
+        with self.prefetch_lock:
+            self.prefetch_cancel.set()
+            prefetched = self.prefetched
+            self.prefetched = {}
+        for prefetch in prefetched.itervalues():
+            prefetch.discard(lambda source: source.close())
+        self.prefetch = None
+
+    def save_firmware(self, f, source):
+        for kb in source.blocks(64 * 1024):
+            f.write(kb)
+
+    def get_manifest_cache(self):
+        if self.manifest_cache is None:
+            ttl = self.manifest_ttl if self.use_cache else 0
+            self.manifest_cache = ManifestCache(self.update_url, ttl,
+                    debug=self.debug)
+        return self.manifest_cache
 
     def fetch_download_versions(self):
-        try:
-            r = requests.get(self.update_url+'/version.json')
-        except Exception as e:
-            if self.debug: print 'fetch_download_versions:', e
-            return False
-        if r.ok:
+        if self.bundle_file is not None:
+            manifest = self.get_bundle().manifest()
+        else:
             try:
-                self.download_firmware_version = DashVersion.fromstring(r.json()['system_firmware_version'])
-                self.download_firmware_url = self.update_url+'/'+r.json()['system_firmware_location'] + str(self.download_firmware_version) + '.bin'
-                self.download_boot_version = DashVersion.fromstring(r.json()['boot_version'])
-                self.download_boot_url = self.update_url+'/'+r.json()['boot_location'] + str(self.download_boot_version) + '.bin'
-                if self.debug:
-                    print 'Download firmware version', self.download_firmware_version
-                    print 'Download firmware', self.download_firmware_url
-                    print 'Download boot version', self.download_boot_version
-                    print 'Download boot', self.download_boot_url
+                manifest = self.get_manifest_cache().fetch()
             except Exception as e:
                 if self.debug: print 'fetch_download_versions:', e
                 return False
+        if manifest is None:
+            return False
+        self.download_firmware_version = manifest.system_firmware_version
+        self.download_firmware_url = manifest.system_firmware_url
+        self.download_boot_version = manifest.boot_version
+        self.download_boot_url = manifest.boot_url
+        if self.debug:
+            print 'Download firmware version', self.download_firmware_version
+            print 'Download firmware', self.download_firmware_url
+            print 'Download boot version', self.download_boot_version
+            print 'Download boot', self.download_boot_url
         return True
 
-    def update_boot_firmware(self, updater, ui):
-        boot_firmware = self.download_firmware(self.download_boot_url)
-        system_firmware = self.download_firmware(self.download_firmware_url)
-        if self.validate_system_memory(boot_firmware) and self.validate_system_memory(system_firmware):
-            filename_firmware = ui.prompt_for_firmware_save('boot_' + str(self.download_boot_version) + '_system_' + str(self.download_firmware_version) + '.bin')
-            if filename_firmware:
-                try:
-                    with open(filename_firmware, 'wb') as f:
-                        f.write(boot_firmware)
-                        while f.tell() < (64 * 1024):
-                            f.write('\xFF')
-                        f.write(system_firmware)
-                except:
-                    ui.show_exception()
-            if not updater.update_system_memory(boot_firmware, 0, 0):
-                self.exception_usb_update()
-            if not updater.update_system_memory(system_firmware, 0, 64):
-                self.exception_usb_update()
+    def device_is_current(self, device_versions):
+        '''True if a fresh cached manifest shows nothing newer for the device'''
+        if self.bundle_file is not None:
+            manifest = self.get_bundle().manifest()
+        elif not self.use_cache:
+            return False
         else:
-            self.download_exception()
+            manifest = self.get_manifest_cache().cached()
+        return manifest is not None and manifest.is_current(device_versions)
+
+    def get_device_record(self):
+        if self.device_record is None:
+            try:
+                self.device_record = DeviceVersionRecord(debug=self.debug)
+            except (IOError, OSError) as e:
+                if self.debug: print 'device versions unavailable:', e
+        return self.device_record
+
+    def record_device_versions(self, serial, versions):
+        record = self.get_device_record()
+        if serial and record is not None:
+            record.record(serial, versions)
+
+    def forget_device_versions(self, serial):
+        record = self.get_device_record()
+        if serial and record is not None:
+            record.forget(serial)
+
+    def update_boot_firmware(self, updater, ui):
+        boot_firmware = self.get_firmware(self.download_boot_url)
+        system_firmware = self.get_firmware(self.download_firmware_url)
+        try:
+            if self.validate_system_memory(boot_firmware) and self.validate_system_memory(system_firmware):
+                filename_firmware = ui.prompt_for_firmware_save('boot_' + str(self.download_boot_version) + '_system_' + str(self.download_firmware_version) + '.bin')
+                if filename_firmware:
+                    try:
+                        with open(filename_firmware, 'wb') as f:
+                            self.save_firmware(f, boot_firmware)
+                            while f.tell() < (64 * 1024):
+                                f.write('\xFF')
+                            self.save_firmware(f, system_firmware)
+                    except:
+                        ui.show_exception()
+                if not updater.composite_update([(0x3C, 0, boot_firmware),
+                        (0x3C, 64, system_firmware)]):
+                    self.exception_usb_update()
+            else:
+                self.download_exception()
+        finally:
+            for source in (boot_firmware, system_firmware):
+                if source is not None:
+                    source.close()
 
     def update_system_firmware(self, updater, ui):
-        system_firmware = self.download_firmware(self.download_firmware_url)
-        if self.validate_system_memory(system_firmware):
-            filename_firmware = ui.prompt_for_firmware_save('system_firmware_' + str(self.download_firmware_version) + '.bin')
-            if filename_firmware:
-                try:
-                    with open(filename_firmware, 'wb') as f:
-                        f.write(system_firmware)
-                except:
-                    ui.show_exception()
-            if not updater.update_system_memory(system_firmware, 0, 0):
-                self.exception_usb_update()
-        else:
-            self.download_exception()
+        system_firmware = self.get_firmware(self.download_firmware_url)
+        try:
+            if self.validate_system_memory(system_firmware):
+                filename_firmware = ui.prompt_for_firmware_save('system_firmware_' + str(self.download_firmware_version) + '.bin')
+                if filename_firmware:
+                    try:
+                        with open(filename_firmware, 'wb') as f:
+                            self.save_firmware(f, system_firmware)
+                    except:
+                        ui.show_exception()
+                if not updater.update_system_memory(system_firmware, 0, 0):
+                    self.exception_usb_update()
+            else:
+                self.download_exception()
+        finally:
+            if system_firmware is not None:
+                system_firmware.close()
 
     def finish_update_usb(self, ui):
-        updater = USBUpdater(self.vid, self.pid, self.debug)
+        self.start_prefetch()
+        try:
+            self.find_and_flash_usb(ui)
+        finally:
+            self.discard_prefetch()
+
+    def find_and_flash_usb(self, ui):
+        # One enumeration finds the board in either mode, no trial opens
+        modes = dict(DASH_MODES)
+        modes[(self.vid, self.pid)] = 'app'
+        index = DeviceIndex(modes, debug=self.debug)
+        device = index.first(self.vid, self.pid)
+        if device is None:
+            device = index.first(0x7722, 0x1200)
+        if device is None:
+            self.exception_usb_update()
+        updater = device.updater(self.debug)
+        updater.set_index(index)
+        updater.set_reset_wait(self.reset_poll)
+        if self.retries is not None:
+            updater.set_retries(self.retries)
+        updater.set_pipeline_depth(self.pipeline_depth)
+        updater.set_sparse(self.sparse)
+        if self.metrics_file or self.debug:
+            updater.set_metrics(FlashMetrics())
         device_versions = DashVersions()
+        try:
+            updater.set_ledger(FlashLedger(debug=self.debug))
+        except (IOError, OSError) as e:
+            if self.debug: print 'flash ledger unavailable:', e
 
-        if updater.device_present():
-            if self.debug: print 'Device found'
-            device_versions = updater.get_device_versions()
-        elif updater.device_present(0x7722, 0x1200):
+        # The device stays open from the version query through the reset
+        if not updater.try_open():
+            self.exception_usb_update()
+        serial = device.serial
+        if device.is_bootloader():
             if self.debug: print 'Device 7722:1200 found'
-            updater.set_ids(0x7722, 0x1200)
+            # The bootloader cannot report versions, use the last ones seen
+            record = self.get_device_record()
+            known = record.get(serial) if record is not None and serial else None
+            if known is not None:
+                device_versions = known
         else:
-            self.exception_usb_update()
+            if self.debug: print 'Device found'
+            device_versions = updater.get_device_versions()
+            self.record_device_versions(serial, device_versions)
 
-        if self.imagetype == 'user' and self.check_update and self.fetch_download_versions():
+        try:
+            self.flash_usb(updater, ui, device_versions, serial)
+        finally:
+            updater.close()
+            if updater.metrics is not None:
+                if self.debug: print updater.metrics
+                if self.metrics_file:
+                    updater.metrics.dump_json(self.metrics_file)
+
+    def flash_usb(self, updater, ui, device_versions, serial=None):
+        if self.imagetype == 'user' and self.check_update and self.device_is_current(device_versions):
+            if self.debug: print 'device firmware is current'
+        elif self.imagetype == 'user' and self.check_update and self.wait_for_manifest():
             if self.debug: print 'checking for updates...'
             if self.debug: print self.download_boot_version, device_versions.system_boot, device_versions.user_boot
-            if self.download_boot_version > min(device_versions.system_boot, device_versions.user_boot):
+            if self.download_boot_version > device_versions.boot():
                 if self.debug:
                     print 'boot available', device_versions.system_boot, '->', self.download_boot_version
-                if ui.ask_boot_update(min(device_versions.system_boot, device_versions.user_boot), self.download_boot_version, device_versions.system_firmware, self.download_firmware_version):
+                self.prefetch_firmware(self.download_boot_url,
+                        self.download_firmware_url)
+                if ui.ask_boot_update(device_versions.boot(), self.download_boot_version, device_versions.system_firmware, self.download_firmware_version):
                     self.update_boot_firmware(updater, ui)
+                    self.record_device_versions(serial, DashVersions(
+                        self.download_boot_version,
+                        self.download_boot_version,
+                        self.download_firmware_version))
             elif self.download_firmware_version > device_versions.system_firmware:
                 if self.debug:
                     print 'firmware available', device_versions.system_firmware, '->', self.download_firmware_version
+                self.prefetch_firmware(self.download_firmware_url)
                 if ui.ask_firmware_update(device_versions.system_firmware, self.download_firmware_version):
                     self.update_system_firmware(updater, ui)
+                    self.record_device_versions(serial, DashVersions(
+                        device_versions.user_boot,
+                        device_versions.system_boot,
+                        self.download_firmware_version))
         elif self.imagetype == 'system':
-            if not updater.update_system(self.imagefile):
+            # Whatever this image is, the recorded versions no longer hold
+            self.forget_device_versions(serial)
+            if not updater.ledger_update_system(self.imagefile, self.incremental):
                 self.exception_usb_update()
 
         if self.imagetype == 'user':
-            if not updater.update_user(self.imagefile):
+            if not updater.ledger_update_user(self.imagefile, self.incremental):
                 self.exception_usb_update()
 
         updater.reset_all()
 
+    def finish_update_gang(self, ui):
+        flasher = GangFlasher(debug=self.debug)
+        if not flasher.enumerate():
+            self.exception_usb_update()
+        if self.imagetype == 'user':
+            results = flasher.update_user(self.imagefile, reset=True)
+        else:
+            results = flasher.update_system(self.imagefile, reset=True)
+            for result in results:
+                self.forget_device_versions(result.serial)
+        failed = [r for r in results if not r.ok]
+        ui.show_message('\n'.join([str(r) for r in results]))
+        if failed:
+            raise KonektException(str(len(failed)) + ' of ' +
+                    str(len(results)) + ' devices failed to update')
+
     def start_update(self, ui):
         if not self.imagetype:
             self.imagetype = ui.prompt_for_imagetype()
@@ -349,6 +749,21 @@ def main():
     parser.add_argument('--deviceid', type=int)
     parser.add_argument('--orgid', type=int,
         help="Needed for OTA if the device isn't on your default organization")
+    parser.add_argument('--device', type=str, metavar='NAME_OR_IMEI',
+        help="Push over OTA to the device with this name or IMEI")
+    parser.add_argument('--resync', action='store_true',
+        help="Fetch the organization and device lists again in full "
+            "instead of using the local copy")
+    parser.add_argument('--all-devices', action='store_true',
+        help="Push over OTA to every device in the organization")
+    parser.add_argument('--device-list', type=str, metavar='FILE',
+        help="Push over OTA to the device IDs in FILE, one per line")
+    parser.add_argument('--filter', type=str, action='append',
+        metavar='KEY=PATTERN', dest='filters',
+        help="Push over OTA to the devices whose KEY field matches the "
+            "wildcard PATTERN, e.g. name=unit-*. Can be repeated")
+    parser.add_argument('--batch-size', type=int,
+        help="Device IDs per OTA push request in bulk mode (default 100)")
     parser.add_argument('--text-mode', action='store_true',
         help="Disable the GUI and do everything via text inputs")
     parser.add_argument('--apibase', type=str, help=argparse.SUPPRESS)
@@ -356,11 +771,47 @@ def main():
     parser.add_argument('--debug', help=argparse.SUPPRESS, action='store_true')
     parser.add_argument('--updateurl', help=argparse.SUPPRESS)
     parser.add_argument('--nocheck', help=argparse.SUPPRESS, action='store_true')
+    parser.add_argument('--bundle', type=str, metavar='FILE',
+        help="Check for boot and system upgrades in a firmware bundle "
+            "instead of downloading them")
+    parser.add_argument('--make-bundle', type=str, metavar='FILE',
+        help="Download the current boot and system firmware into a bundle "
+            "for --bundle and exit")
+    parser.add_argument('--gang', action='store_true',
+        help="Flash every connected Dash in parallel over USB")
+    parser.add_argument('--incremental', action='store_true',
+        help="Only send the USB blocks that changed since the last flash")
+    parser.add_argument('--sparse', action='store_true',
+        help="Don't send erased (all 0xFF) USB blocks that the flash ledger "
+            "records as already erased on the device")
+    parser.add_argument('--reset-sleep', help=argparse.SUPPRESS,
+            action='store_true')
+    parser.add_argument('--retries', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--pipeline-depth', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--nocache', help=argparse.SUPPRESS, action='store_true')
+    parser.add_argument('--manifest-ttl', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+        help="Give up on a network request after SECONDS")
+    parser.add_argument('--http2', action='store_true',
+        help="Talk HTTP/2 to https servers (needs the hyper package)")
+    # Run against in-process emulated devices instead of real hardware
+    parser.add_argument('--emulate', type=int, nargs='?', const=1,
+            metavar='DEVICES', help=argparse.SUPPRESS)
+    parser.add_argument('--metrics', type=str, metavar='FILE',
+        help="Write USB write timings for the update to FILE as JSON")
     # This is so that in Arduino we don't generate a dialog box on success
     # and just print to the console
     parser.add_argument('--use-text-success', help=argparse.SUPPRESS,
             action='store_true')
     args = parser.parse_args()
+    if args.timeout or args.http2:
+        client_args = {'http2': args.http2, 'debug': args.debug}
+        if args.timeout:
+            client_args['timeout'] = args.timeout
+        set_default_client(HTTPClient(**client_args))
+    if args.emulate:
+        set_default_backend(EmulatorBackend([EmulatedDash('EMU%05d' % i)
+            for i in range(args.emulate)]))
     updater = DashUpdater(version)
     if args.vid:
         updater.set_vid(args.vid)
@@ -386,6 +837,52 @@ def main():
         updater.set_check_update(False)
     if args.orgid:
         updater.set_orgid(args.orgid)
+    if args.device:
+        updater.set_device(args.device)
+    if args.resync:
+        updater.set_resync(True)
+    if args.all_devices:
+        updater.set_all_devices(True)
+    if args.device_list:
+        updater.set_device_list_file(args.device_list)
+    if args.filters:
+        updater.set_device_filters(args.filters)
+    if args.batch_size is not None:
+        if args.batch_size < 1:
+            parser.error('--batch-size must be at least 1')
+        updater.set_batch_size(args.batch_size)
+    if args.gang:
+        updater.set_gang(True)
+    if args.incremental:
+        updater.set_incremental(True)
+    if args.sparse:
+        updater.set_sparse(True)
+    if args.reset_sleep:
+        updater.set_reset_poll(False)
+    if args.metrics:
+        updater.set_metrics_file(args.metrics)
+    if args.retries is not None:
+        updater.set_retries(args.retries)
+    if args.pipeline_depth is not None:
+        if args.pipeline_depth < 0:
+            parser.error('--pipeline-depth must not be negative')
+        updater.set_pipeline_depth(args.pipeline_depth)
+    if args.nocache:
+        updater.set_use_cache(False)
+    if args.manifest_ttl is not None:
+        updater.set_manifest_ttl(args.manifest_ttl)
+    if args.bundle and args.updateurl:
+        parser.error('--bundle replaces --updateurl, give only one of them')
+    if args.bundle:
+        updater.set_bundle_file(args.bundle)
+    if args.make_bundle:
+        try:
+            updater.make_bundle(args.make_bundle)
+        except (KonektException, UpdaterException) as e:
+            print 'Error:', e
+            sys.exit(1)
+        print 'Bundle written to', args.make_bundle
+        return
     updater.update(args.text_mode, args.use_text_success)
 
 def get_basedir():
@@ -0,0 +1,152 @@
+#
+#  bundle.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from kexceptions import UpdaterException
+from cachedir import replace_file
+from imagesource import ImageSource
+from manifest import FirmwareManifest
+from usbupdater import DashVersion
+import hashlib
+import json
+import mmap
+import struct
+
+MAGIC = 'DASHBNDL'
+FORMAT = 1
+# magic, format, index offset, index length
+HEADER = struct.Struct('<8sIQI')
+# Images start on a page boundary so each could be mapped on its own
+ALIGN = mmap.ALLOCATIONGRANULARITY
+
+class FirmwareBundle:
+    '''A boot and system firmware release in one file, for stations that
+    can't reach the update URL.
+
+    The file is a fixed header, the images (each aligned to ALIGN) and a
+    JSON index at the end holding the versions along with the offset, size
+    and sha256 of every image. The whole file is memory mapped, so images
+    are handed out as zero-copy ImageSources. Each image's digest is checked
+    the first time it's used.
+    '''
+    def __init__(self, filename, debug=False):
+        self.filename = filename
+        self.debug = debug
+        self.f = open(filename, 'rb')
+        try:
+            self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, format, offset, length = HEADER.unpack_from(self.data)
+            if magic != MAGIC:
+                raise UpdaterException(filename + ' is not a firmware bundle')
+            if format != FORMAT:
+                raise UpdaterException('Unsupported bundle format ' + str(format))
+            self.index = json.loads(self.data[offset:offset+length])
+        except (ValueError, mmap.error, struct.error) as e:
+            self.close()
+            raise UpdaterException('Invalid firmware bundle ' + filename +
+                    ': ' + str(e))
+        except:
+            self.close()
+            raise
+        self.verified = set()
+
+    def manifest(self):
+        '''The FirmwareManifest of the release, its URLs being image names'''
+        versions = self.index['versions']
+        return FirmwareManifest(
+                DashVersion.fromstring(versions['system_firmware_version']),
+                'system',
+                DashVersion.fromstring(versions['boot_version']),
+                'boot')
+
+    def names(self):
+        return self.index['images'].keys()
+
+    def image(self, name):
+        '''The image as an ImageSource over the bundle's mapping'''
+        entry = self.index['images'].get(name)
+        if entry is None:
+            raise UpdaterException('No ' + name + ' image in ' + self.filename)
+        view = buffer(self.data, entry['offset'], entry['size'])
+        if len(view) != entry['size']:
+            raise UpdaterException('Truncated firmware bundle ' + self.filename)
+        if name not in self.verified:
+            if hashlib.sha256(view).hexdigest() != entry['sha256']:
+                raise UpdaterException('Corrupt ' + name + ' image in ' +
+                        self.filename)
+            self.verified.add(name)
+        if self.debug: print 'bundle image', name, entry['size'], 'bytes'
+        return ImageSource(view)
+
+    def close(self):
+        if getattr(self, 'data', None) is not None:
+            self.data.close()
+            self.data = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def write_bundle(filename, manifest, images):
+    '''Write a FirmwareBundle.
+
+    Keyword arguments:
+    manifest -- the FirmwareManifest of the release
+    images -- {'boot': image, 'system': image}, each anything ImageSource
+        can wrap
+    '''
+    index = {
+        'versions': {
+            'system_firmware_version': str(manifest.system_firmware_version),
+            'boot_version': str(manifest.boot_version),
+        },
+        'images': {},
+    }
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write('\0' * HEADER.size)
+        for name, image in sorted(images.items()):
+            f.write('\0' * (-f.tell() % ALIGN))
+            source = ImageSource.wrap(image)
+            offset = f.tell()
+            sha = hashlib.sha256()
+            for block in source.blocks(64 * 1024):
+                sha.update(block)
+                f.write(block)
+            index['images'][name] = {'offset': offset, 'size': len(source),
+                    'sha256': sha.hexdigest()}
+        offset = f.tell()
+        data = json.dumps(index, sort_keys=True)
+        f.write(data)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT, offset, len(data)))
+    replace_file(tmp, filename)
@@ -0,0 +1,170 @@
+#
+#  cachedir.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import errno
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+def get_cache_dir(*parts):
+    '''Returns (and creates) a directory for the updater's local state.
+
+    Defaults to ~/.dashupdater, and can be moved with the DASHUPDATER_CACHE
+    environment variable, e.g. to share it between stations.
+    '''
+    base = os.environ.get('DASHUPDATER_CACHE')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.dashupdater')
+    path = os.path.join(base, *parts)
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return path
+
+def replace_file(src, dst):
+    '''Atomically move src over dst where the OS allows it'''
+    if os.name == 'nt' and os.path.exists(dst):
+        # os.rename() won't overwrite on Windows
+        os.remove(dst)
+    os.rename(src, dst)
+
+class FileLock:
+    '''An exclusive lock shared between processes, held on a lock file.
+    Threads sharing one FileLock take turns on it like on a threading.Lock
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = None
+        self.thread_lock = threading.Lock()
+
+    def acquire(self):
+        self.thread_lock.acquire()
+        try:
+            f = open(self.filename, 'a+b')
+        except:
+            self.thread_lock.release()
+            raise
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except IOError:
+                        # LK_LOCK gives up after 10 seconds, keep waiting
+                        pass
+        except:
+            f.close()
+            self.thread_lock.release()
+            raise
+        self.f = f
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        else:
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+        self.f.close()
+        self.f = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+def update_json(filename, update):
+    '''Apply update() to the dict stored as JSON in filename and write it
+    back, all under filename.lock, so that concurrent updaters don't drop
+    each other's changes. Returns the dict as written.
+    '''
+    with FileLock(filename + '.lock'):
+        try:
+            with open(filename, 'rb') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            data = {}
+        update(data)
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            json.dump(data, f)
+        replace_file(tmp, filename)
+    return data
+
+class JSONStore:
+    '''A dict of entries kept in a JSON file that several updaters share.
+
+    Every change is made to the file as it is on disk (see update_json()),
+    so it only touches its own entry. If the file can't be written the
+    change is kept in memory, for this run only.
+    '''
+    def __init__(self, filename, name, debug=False):
+        self.filename = filename
+        self.name = name
+        self.debug = debug
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError) as e:
+            if self.debug: print self.name, 'not loaded:', e
+            self.entries = {}
+
+    def change(self, change):
+        '''Apply change(entries) to the file and to self.entries'''
+        try:
+            self.entries = update_json(self.filename, change)
+        except (IOError, OSError) as e:
+            if self.debug: print self.name, 'not saved:', e
+            change(self.entries)
+
+    def update(self, key, entry):
+        '''Set (or with entry None, remove) one entry'''
+        def change(entries):
+            if entry is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = entry
+        self.change(change)
@@ -0,0 +1,203 @@
+#
+#  dashemulator.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from usbupdater import DashVersion, DashVersions
+import random
+import threading
+import time
+
+APP_IDS = (0x2cf3, 0x1100)
+BOOTLOADER_IDS = (0x7722, 0x1200)
+
+class EmulatedDash:
+    '''An in-process Dash that understands the updater's HID reports.
+
+    Flash is kept per destination (0x18 user, 0x3C system) as a dict of
+    block_id -> 1 KB block. Each report erases and programs only the block
+    it addresses (a short final payload leaves the rest of its block
+    erased). Every other block keeps what it held before, so anything the
+    updater doesn't send stays as it was. A reset (0xFC) makes the device
+    drop off the enumeration for reset_time seconds, and handles opened
+    before it stop working, like on real hardware.
+
+    Keyword arguments:
+    serial -- USB serial number
+    versions -- DashVersions answered to feature report 0x40
+    bootloader -- enumerate as 7722:1200 instead of 2cf3:1100
+    write_latency -- seconds every report write takes
+    fail_rate -- probability of any report write failing
+    fail_writes -- numbers of the writes (counted from 1) that fail
+    reset_time -- seconds the device is gone after a reset
+    '''
+    def __init__(self, serial='EMU00001', versions=None, bootloader=False,
+            write_latency=0.0, fail_rate=0.0, fail_writes=(), reset_time=0.1,
+            seed=None):
+        self.serial = serial
+        if versions is None:
+            versions = DashVersions(DashVersion(0, 9, 0), DashVersion(0, 9, 0),
+                    DashVersion(0, 9, 0))
+        self.versions = versions
+        self.vid, self.pid = BOOTLOADER_IDS if bootloader else APP_IDS
+        self.path = None
+        self.write_latency = write_latency
+        self.fail_rate = fail_rate
+        self.fail_writes = set(fail_writes)
+        self.reset_time = reset_time
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.flash = {0x18: {}, 0x3C: {}}
+        self.writes = 0
+        self.failed_writes = 0
+        self.resets = 0
+        self.generation = 0
+        self.back_at = 0
+
+    def present(self):
+        return time.time() >= self.back_at
+
+    def image(self, packet_id, first_block=0, blocks=None):
+        '''Returns the flashed contents of a destination as a str. Blocks
+        that were never written read as erased (0xFF)
+        '''
+        flash = self.flash[packet_id]
+        if blocks is None:
+            blocks = max(flash.keys() + [first_block - 1]) + 1 - first_block
+        return ''.join(flash.get(block_id, '\xFF' * 1024)
+                for block_id in xrange(first_block, first_block + blocks))
+
+    def load(self, packet_id, data, first_block=0):
+        '''Preload flash contents, e.g. an older image to flash over'''
+        for i in xrange(0, len(data), 1024):
+            self.program(packet_id, first_block + i / 1024, data[i:i+1024])
+
+    def program(self, packet_id, block_id, payload):
+        payload = str(payload)
+        self.flash[packet_id][block_id] = payload + '\xFF' * (1024 - len(payload))
+
+    def feature_report(self, report_id):
+        v = self.versions
+        return [0x40,
+                v.user_boot.major, v.user_boot.minor, v.user_boot.revision,
+                0, 0, 0,
+                v.system_boot.major, v.system_boot.minor, v.system_boot.revision,
+                v.system_firmware.major, v.system_firmware.minor,
+                v.system_firmware.revision]
+
+    def decode(self, data):
+        '''Returns (packet_id, block_id, payload) of a report'''
+        if self.vid == BOOTLOADER_IDS[0]:
+            if len(data) < 65 or data[1] != data[4]:
+                raise ValueError('malformed bootloader report')
+            return data[1], data[5] | (data[6] << 8), data[65:]
+        if len(data) < 4 or data[0] != 0x33:
+            raise ValueError('malformed report')
+        return data[1], data[2] | (data[3] << 8), data[4:]
+
+    def write(self, generation, data):
+        with self.lock:
+            self.writes += 1
+            if self.write_latency:
+                time.sleep(self.write_latency)
+            if generation != self.generation or not self.present() or \
+                    self.writes in self.fail_writes or \
+                    self.random.random() < self.fail_rate:
+                self.failed_writes += 1
+                return -1
+            packet_id, block_id, payload = self.decode(data)
+            if packet_id == 0xFC:
+                self.resets += 1
+                self.generation += 1
+                self.back_at = time.time() + self.reset_time
+            elif packet_id in self.flash:
+                self.program(packet_id, block_id, payload)
+            return len(data)
+
+class EmulatedHandle:
+    '''Stands in for hid.device()'''
+    def __init__(self, backend):
+        self.backend = backend
+        self.dash = None
+        self.generation = None
+
+    def _attach(self, dash):
+        if dash is None:
+            raise IOError('open failed')
+        self.dash = dash
+        self.generation = dash.generation
+
+    def open(self, vid, pid):
+        self._attach(self.backend.find(lambda d: (d.vid, d.pid) == (vid, pid)))
+
+    def open_path(self, path):
+        self._attach(self.backend.find(lambda d: d.path == path))
+
+    def write(self, buff):
+        if self.dash is None:
+            raise ValueError('not open')
+        return self.dash.write(self.generation, bytearray(buff))
+
+    def get_feature_report(self, report_id, max_length):
+        if self.dash is None:
+            raise ValueError('not open')
+        if self.dash.vid == BOOTLOADER_IDS[0] or \
+                self.generation != self.dash.generation:
+            raise IOError('read error')
+        return self.dash.feature_report(report_id)[:max_length]
+
+    def get_serial_number_string(self):
+        if self.dash is None:
+            raise ValueError('not open')
+        return unicode(self.dash.serial)
+
+    def close(self):
+        self.dash = None
+
+class EmulatorBackend:
+    '''A HID backend (see hidbackend.py) serving EmulatedDash devices'''
+    def __init__(self, devices=None):
+        if devices is None:
+            devices = [EmulatedDash()]
+        self.devices = devices
+        for i, dash in enumerate(devices):
+            dash.path = 'emulator:' + str(i)
+
+    def find(self, match):
+        for dash in self.devices:
+            if dash.present() and match(dash):
+                return dash
+        return None
+
+    def device(self):
+        return EmulatedHandle(self)
+
+    def enumerate(self, vid=0, pid=0):
+        return [{'vendor_id': d.vid, 'product_id': d.pid, 'path': d.path,
+                 'serial_number': unicode(d.serial),
+                 'product_string': u'Dash emulator'}
+                for d in self.devices if d.present() and
+                vid in (0, d.vid) and pid in (0, d.pid)]
@@ -0,0 +1,147 @@
+#
+#  discovery.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from hidbackend import get_default_backend
+from usbupdater import USBUpdater
+import os
+import time
+
+# Every Dash VID/PID and the mode the board is in when it uses it
+DASH_MODES = {
+    (0x2cf3, 0x1100): 'app',
+    (0x7722, 0x1200): 'bootloader',
+}
+
+# Only Linux has a cheap way to notice hotplug without enumerating
+HIDRAW_DIR = '/sys/class/hidraw'
+
+class DashDevice:
+    def __init__(self, info, mode):
+        self.vid = info['vendor_id']
+        self.pid = info['product_id']
+        self.path = info['path']
+        self.serial = info.get('serial_number')
+        self.mode = mode
+
+    def is_bootloader(self):
+        return self.mode == 'bootloader'
+
+    def updater(self, debug=False, backend=None):
+        '''A USBUpdater that opens exactly this device'''
+        updater = USBUpdater(self.vid, self.pid, debug)
+        if backend is not None:
+            updater.set_backend(backend)
+        updater.set_path(self.path)
+        return updater
+
+    def __repr__(self):
+        return '%04x:%04x %s serial %s (%s)' % (self.vid, self.pid, self.path,
+                self.serial, self.mode)
+
+class DeviceIndex:
+    '''Every connected Dash, from a single HID enumeration.
+
+    Devices are indexed by VID/PID, path and serial number. The scan is
+    cached until invalidate() is called (USBUpdater does after a reset or a
+    failed open, as the device re-enumerates), until max_age seconds have
+    passed, or, on Linux, until a hidraw device comes or goes.
+    '''
+    def __init__(self, modes=DASH_MODES, backend=None, max_age=None, debug=False):
+        self.modes = modes
+        self.backend = backend
+        self.max_age = max_age
+        self.debug = debug
+        self.invalidate()
+
+    def invalidate(self):
+        self.scanned_at = None
+        self.signature = None
+        self.devices = []
+        self.by_path = {}
+        self.by_serial = {}
+        self.by_ids = {}
+
+    def hotplug_signature(self):
+        if self.backend is not None or not os.path.isdir(HIDRAW_DIR):
+            return None
+        return tuple(sorted(os.listdir(HIDRAW_DIR)))
+
+    def stale(self):
+        if self.scanned_at is None:
+            return True
+        if self.max_age is not None and time.time() - self.scanned_at > self.max_age:
+            return True
+        signature = self.hotplug_signature()
+        return signature is not None and signature != self.signature
+
+    def scan(self):
+        backend = self.backend or get_default_backend()
+        self.invalidate()
+        self.signature = self.hotplug_signature()
+        for info in backend.enumerate(0, 0):
+            ids = (info['vendor_id'], info['product_id'])
+            mode = self.modes.get(ids)
+            if mode is None:
+                continue
+            device = DashDevice(info, mode)
+            self.devices.append(device)
+            self.by_path[device.path] = device
+            if device.serial:
+                self.by_serial[device.serial] = device
+            self.by_ids.setdefault(ids, []).append(device)
+        self.scanned_at = time.time()
+        if self.debug:
+            for device in self.devices:
+                print 'found', device
+        return self.devices
+
+    def refresh(self):
+        if self.stale():
+            self.scan()
+
+    def all(self, mode=None):
+        self.refresh()
+        return [d for d in self.devices if mode is None or d.mode == mode]
+
+    def find(self, vid, pid):
+        self.refresh()
+        return self.by_ids.get((vid, pid), [])
+
+    def first(self, vid, pid):
+        devices = self.find(vid, pid)
+        if devices:
+            return devices[0]
+        return None
+
+    def get_path(self, path):
+        self.refresh()
+        return self.by_path.get(path)
+
+    def get_serial(self, serial):
+        self.refresh()
+        return self.by_serial.get(serial)
@@ -0,0 +1,100 @@
+#
+#  download.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from kexceptions import UpdaterException
+from imagesource import ImageSource
+from httpclient import get_default_client
+import hashlib
+import tempfile
+
+CHUNK_SIZE = 16 * 1024
+
+class HeaderCheck:
+    '''Checks for a tag at a fixed offset of an image, so a download can
+    be rejected as soon as its first size bytes have arrived.
+    '''
+    def __init__(self, offset, tag):
+        self.offset = offset
+        self.tag = tag
+        self.size = offset + len(tag)
+
+    def __call__(self, head):
+        return head[self.offset:self.size] == self.tag
+
+SYSTEM_HEADER = HeaderCheck(0xC0, 'APP0DPM2')
+
+def spool(response, f, check=None, chunk_size=CHUNK_SIZE, cancel=None):
+    '''Copy a streamed response into the file f chunk by chunk, hashing it
+    on the way. Raises UpdaterException as soon as the image fails check,
+    or once the threading.Event cancel is set.
+
+    returns (sha256 hex digest, size)
+    '''
+    sha = hashlib.sha256()
+    size = 0
+    head = ''
+    for chunk in response.iter_content(chunk_size):
+        if cancel is not None and cancel.is_set():
+            raise UpdaterException('Download of ' + response.url +
+                    ' cancelled')
+        if check is not None and head is not None:
+            head += chunk[:check.size - len(head)]
+            if len(head) == check.size:
+                if not check(head):
+                    raise UpdaterException('Invalid image header in ' +
+                            response.url)
+                head = None
+        sha.update(chunk)
+        f.write(chunk)
+        size += len(chunk)
+    if check is not None and head is not None:
+        raise UpdaterException('Image too short in ' + response.url)
+    return sha.hexdigest(), size
+
+def download(url, check=None, dir=None, debug=False, cancel=None):
+    '''Stream url into an anonymous temporary file and return it as a
+    mapped ImageSource, or None if the server refused it.
+
+    Memory use is bounded by the chunk size whatever the image size, and
+    the file goes away when the source is closed.
+    '''
+    r = get_default_client().get(url, stream=True)
+    try:
+        if not r.ok:
+            return None
+        f = tempfile.TemporaryFile(dir=dir)
+        try:
+            digest, size = spool(r, f, check, cancel=cancel)
+            f.flush()
+        except:
+            f.close()
+            raise
+        if debug: print 'downloaded', url, size, 'bytes', digest
+        return ImageSource.fromfileobj(f)
+    finally:
+        r.close()
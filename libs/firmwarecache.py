@@ -0,0 +1,232 @@
+#
+#  firmwarecache.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from cachedir import get_cache_dir, replace_file, FileLock
+from download import spool
+from httpclient import get_default_client
+from imagesource import ImageSource
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# Files in objects/ that the index doesn't know about are removed once
+# nothing has written to them for this long
+STALE_AGE = 3600
+
+class FirmwareCache:
+    '''Downloaded firmware images, stored on disk by sha256.
+
+    index.json maps every URL to the digest of its last download along
+    with its ETag/Last-Modified, which are sent back to revalidate instead
+    of downloading again. Objects are evicted least recently used first
+    once the cache grows past max_bytes. Each URL is downloaded under a
+    lock file in locks/ picked by its hash, so concurrent updaters wait for
+    one download of a URL and share it, while different URLs (bar the odd
+    collision) download in parallel. The index has a lock of its own that
+    is only held to read or update it.
+    '''
+    def __init__(self, root=None, max_bytes=64 * 1024 * 1024, debug=False):
+        if root is None:
+            root = get_cache_dir('firmware')
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        self.locks = os.path.join(root, 'locks')
+        for path in (self.objects, self.locks):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        self.index_file = os.path.join(root, 'index.json')
+        self.lock = FileLock(os.path.join(root, 'lock'))
+        self.max_bytes = max_bytes
+        self.debug = debug
+
+    def load_index(self):
+        try:
+            with open(self.index_file, 'rb') as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            index = {}
+        index.setdefault('urls', {})
+        index.setdefault('objects', {})
+        return index
+
+    def save_index(self, index):
+        tmp = self.index_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            json.dump(index, f)
+        replace_file(tmp, self.index_file)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest)
+
+    def read(self, digest):
+        with open(self.object_path(digest), 'rb') as f:
+            return f.read()
+
+    def url_lock(self, url):
+        # At most 256 lock files, however many URLs pass through
+        name = hashlib.sha1(url).hexdigest()[:2] + '.lock'
+        return FileLock(os.path.join(self.locks, name))
+
+    def store(self, response, check=None, cancel=None):
+        '''Stream response into the cache, hashing it on the way, so
+        the image is never held in memory as a whole.
+
+        returns (digest, size)
+        '''
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.objects)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                digest, size = spool(response, f, check, cancel=cancel)
+            replace_file(tmp, self.object_path(digest))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return digest, size
+
+    def sweep(self, index):
+        '''Remove the files in objects/ that aren't in the index and that
+        nothing has written to for STALE_AGE seconds, like downloads that
+        died halfway.
+
+        returns the size of the ones still being written
+        '''
+        size = 0
+        now = time.time()
+        for name in os.listdir(self.objects):
+            if name in index['objects']:
+                continue
+            path = os.path.join(self.objects, name)
+            try:
+                st = os.stat(path)
+                if now - st.st_mtime > STALE_AGE:
+                    if self.debug: print 'firmware cache removing', name
+                    os.remove(path)
+                else:
+                    size += st.st_size
+            except OSError:
+                pass
+        return size
+
+    def evict(self, index, keep):
+        objects = index['objects']
+        total = sum(o['size'] for o in objects.itervalues()) + \
+                self.sweep(index)
+        for digest in sorted(objects, key=lambda d: objects[d]['used']):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            if self.debug: print 'firmware cache evicting', digest
+            total -= objects.pop(digest)['size']
+            try:
+                os.remove(self.object_path(digest))
+            except OSError:
+                pass
+        for url, entry in index['urls'].items():
+            if entry['digest'] not in objects:
+                del index['urls'][url]
+
+    def cached(self, index, url):
+        '''The index entry for url if its object is still on disk'''
+        entry = index['urls'].get(url)
+        if entry and os.path.exists(self.object_path(entry['digest'])):
+            return entry
+        return None
+
+    def fetch(self, url):
+        '''Returns the contents of url, downloading it only if the cached
+        copy is missing or the server says it changed. None if the download
+        failed and nothing is cached
+        '''
+        digest = self.fetch_digest(url)
+        if digest is None:
+            return None
+        return self.read(digest)
+
+    def fetch_source(self, url, check=None, cancel=None):
+        '''Like fetch(), but returns the cached object as a mapped
+        ImageSource. check (see download.HeaderCheck) is applied to new
+        downloads as they arrive, and setting cancel stops them
+        '''
+        digest = self.fetch_digest(url, check, cancel)
+        if digest is None:
+            return None
+        return ImageSource.fromfile(self.object_path(digest))
+
+    def fetch_digest(self, url, check=None, cancel=None):
+        with self.url_lock(url):
+            with self.lock:
+                entry = self.cached(self.load_index(), url)
+            headers = {}
+            if entry:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+            try:
+                r = get_default_client().get(url, headers=headers,
+                        stream=True)
+            except Exception as e:
+                if not entry:
+                    raise
+                # Offline, but we have a copy
+                if self.debug: print 'firmware cache revalidation failed:', e
+                r = None
+            if r is not None and not r.ok and entry:
+                # The server is having trouble, but we have a copy
+                if self.debug:
+                    print 'firmware cache revalidation failed:', r.status_code
+                r.close()
+                r = None
+            try:
+                if r is not None and r.status_code != 304:
+                    if not r.ok:
+                        return None
+                    digest, size = self.store(r, check, cancel)
+                    entry = {
+                        'digest': digest,
+                        'etag': r.headers.get('ETag'),
+                        'last_modified': r.headers.get('Last-Modified'),
+                    }
+                    if self.debug: print 'firmware cache stored', url, digest
+                else:
+                    digest = entry['digest']
+                    size = os.path.getsize(self.object_path(digest))
+                    if self.debug: print 'firmware cache hit', url, digest
+            finally:
+                if r is not None:
+                    r.close()
+            with self.lock:
+                index = self.load_index()
+                index['objects'][digest] = {'size': size, 'used': time.time()}
+                index['urls'][url] = entry
+                self.evict(index, digest)
+                self.save_index(index)
+            return digest
@@ -0,0 +1,90 @@
+#
+#  flashledger.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from cachedir import get_cache_dir, JSONStore
+import hashlib
+import os
+
+def block_hashes(source, first_block=0):
+    '''Returns {block_id: sha1 hex digest} for every block of an ImageSource'''
+    hashes = {}
+    block_id = first_block
+    for kb in source.blocks():
+        hashes[block_id] = hashlib.sha1(kb).hexdigest()
+        block_id += 1
+    return hashes
+
+class FlashLedger(JSONStore):
+    '''Remembers which image blocks were last flashed to each device.
+
+    Entries are keyed by the device serial number and the destination
+    partition (0x18 user, 0x3C system) and hold a hash per block, so that
+    the next flash only needs to send the blocks that changed.
+
+    The ledger only knows about flashes done by this updater. A partition
+    is forgotten before it is written and recorded again once the write
+    succeeded, so an interrupted flash never leaves a stale entry. Several
+    updaters can share the ledger file, see JSONStore.
+    '''
+    def __init__(self, filename=None, debug=False):
+        if filename is None:
+            filename = os.path.join(get_cache_dir(), 'flash_ledger.json')
+        JSONStore.__init__(self, filename, 'flash ledger', debug)
+
+    def update_partition(self, serial, packet_id, blocks):
+        '''Set (or with blocks None, remove) one entry in the file'''
+        def change(entries):
+            device = entries.setdefault(serial, {})
+            if blocks is None:
+                device.pop(self._key(packet_id), None)
+            else:
+                device[self._key(packet_id)] = blocks
+        # The ledger is an optimization, a flash never fails over it
+        self.change(change)
+
+    def _key(self, packet_id):
+        return hex(packet_id)
+
+    def get(self, serial, packet_id):
+        # Another updater may have flashed the device since
+        self.load()
+        blocks = self.entries.get(serial, {}).get(self._key(packet_id), {})
+        return dict((int(block_id), h) for block_id, h in blocks.iteritems())
+
+    def forget(self, serial, packet_id):
+        self.update_partition(serial, packet_id, None)
+
+    def record(self, serial, packet_id, hashes):
+        blocks = dict((str(block_id), h) for block_id, h in hashes.iteritems())
+        self.update_partition(serial, packet_id, blocks)
+
+    def changed_blocks(self, serial, packet_id, hashes):
+        '''Returns the sorted block ids of hashes that differ from the ledger'''
+        known = self.get(serial, packet_id)
+        return sorted(block_id for block_id, h in hashes.iteritems()
+                if known.get(block_id) != h)
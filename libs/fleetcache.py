@@ -0,0 +1,227 @@
+#
+#  fleetcache.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from cachedir import get_cache_dir
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Rows written per transaction while a listing streams in
+INSERT_BATCH = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS orgs (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER NOT NULL,
+    name TEXT,
+    imei TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER NOT NULL,
+    name TEXT,
+    imei TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orgs_parent ON orgs (parent, id);
+CREATE INDEX IF NOT EXISTS devices_parent ON devices (parent, id);
+CREATE INDEX IF NOT EXISTS devices_name ON devices (name);
+CREATE INDEX IF NOT EXISTS devices_imei ON devices (imei);
+CREATE TABLE IF NOT EXISTS synced (
+    scope TEXT PRIMARY KEY,
+    refreshed REAL NOT NULL,
+    resynced REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+def device_imei(device):
+    '''The IMEI of a device from the API, if it has one'''
+    if device.get('imei'):
+        return str(device['imei'])
+    links = device.get('links') or {}
+    for link in links.get('cellular') or []:
+        if link.get('imei'):
+            return str(link['imei'])
+    return None
+
+class FleetCache:
+    '''The organizations and devices of an account, kept in SQLite.
+
+    Listings are only refreshed once they are older than ttl seconds, and
+    then only the entries with IDs above the highest one known are fetched,
+    as the API hands out IDs in increasing order. That misses renames and
+    deletions, so a listing is fetched in full again every resync_age
+    seconds or when asked to. Devices are indexed by ID, name and IMEI.
+    Rows keep the API's JSON, so cached entries look just like fresh ones.
+    '''
+    def __init__(self, filename, ttl=3600, resync_age=7 * 24 * 3600,
+            debug=False):
+        self.filename = filename
+        self.ttl = ttl
+        self.resync_age = resync_age
+        self.debug = debug
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def for_account(cls, apibase, apikey, ttl=3600, debug=False):
+        '''The cache of the account behind apikey, one file per account'''
+        name = hashlib.sha1(apibase + '\0' + apikey).hexdigest() + '.sqlite'
+        return cls(os.path.join(get_cache_dir('fleet'), name), ttl,
+                debug=debug)
+
+    def close(self):
+        self.db.close()
+
+    def get_meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_meta(self, key, value):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                    (key, value))
+
+    def sync_state(self, scope, resync, refresh=False):
+        '''None if the scope is fresh (and refresh isn't set), else
+        'incremental' or 'resync' '''
+        row = self.db.execute(
+                'SELECT refreshed, resynced FROM synced WHERE scope = ?',
+                (scope,)).fetchone()
+        now = time.time()
+        if resync or row is None or now - row[1] > self.resync_age:
+            return 'resync'
+        if refresh or now - row[0] > self.ttl:
+            return 'incremental'
+        return None
+
+    def rows(self, table, parent):
+        cursor = self.db.execute('SELECT data FROM ' + table +
+                ' WHERE parent = ? ORDER BY id', (parent,))
+        for row in cursor:
+            yield json.loads(row[0])
+
+    def sync(self, table, scope, parent, fetch, resync=False, refresh=False):
+        '''Generates the cached rows of a listing, then any new ones as
+        fetch(startafter) returns them. A resync fetches the whole listing
+        instead, and rows that aren't in it any more are dropped once it
+        has been read to the end.
+
+        New rows are stored as they arrive, so stopping early keeps what
+        was seen, and the listing only counts as refreshed once it has been
+        read to the end.
+        '''
+        state = self.sync_state(scope, resync, refresh)
+        if self.debug: print 'fleet cache', scope, state or 'fresh'
+        if state == 'resync':
+            last = None
+            seen = set()
+        else:
+            for item in self.rows(table, parent):
+                yield item
+            if state is None:
+                return
+            last = self.db.execute('SELECT MAX(id) FROM ' + table +
+                    ' WHERE parent = ?', (parent,)).fetchone()[0]
+        items = fetch(last)
+        pending = []
+        try:
+            for item in items:
+                pending.append((item['id'], parent, item.get('name'),
+                    device_imei(item), json.dumps(item)))
+                if state == 'resync':
+                    seen.add(item['id'])
+                yield item
+                if len(pending) >= INSERT_BATCH:
+                    self.insert(table, pending)
+                    pending = []
+        finally:
+            items.close()
+            self.insert(table, pending)
+        now = time.time()
+        with self.db:
+            if state == 'resync':
+                cursor = self.db.execute('SELECT id FROM ' + table +
+                        ' WHERE parent = ?', (parent,))
+                stale = [row for row in cursor if row[0] not in seen]
+                if self.debug: print 'fleet cache dropping', len(stale)
+                self.db.executemany('DELETE FROM ' + table + ' WHERE id = ?',
+                        stale)
+                self.db.execute('INSERT OR REPLACE INTO synced VALUES (?, ?, ?)',
+                        (scope, now, now))
+            else:
+                self.db.execute('UPDATE synced SET refreshed = ? WHERE scope = ?',
+                        (now, scope))
+
+    def insert(self, table, rows):
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO ' + table +
+                    ' VALUES (?, ?, ?, ?, ?)', rows)
+
+    def get_userid(self, updater, resync=False):
+        userid = self.get_meta('userid')
+        if userid is None or resync:
+            userid = str(updater.load_userinfo()['id'])
+            self.set_meta('userid', userid)
+        return int(userid)
+
+    def orgs(self, updater, resync=False):
+        '''The account's organizations, as a list'''
+        userid = self.get_userid(updater, resync)
+        return list(self.sync('orgs', 'orgs:%d' % userid, userid,
+            lambda startafter: updater.iter_orgs(userid, startafter), resync))
+
+    def devices(self, updater, orgid, resync=False, refresh=False):
+        '''Generates the devices of an organization'''
+        return self.sync('devices', 'devices:%d' % orgid, orgid,
+            lambda startafter: updater.iter_devices(orgid, startafter),
+            resync, refresh)
+
+    def refresh_devices(self, updater, orgid, resync=False):
+        '''Fetch the devices added since the last refresh, TTL or not'''
+        for device in self.devices(updater, orgid, resync, True):
+            pass
+
+    def find_devices(self, column, value):
+        '''(orgid, device) for the cached devices whose column (id, name
+        or imei) is value'''
+        cursor = self.db.execute('SELECT parent, data FROM devices WHERE ' +
+                column + ' = ? ORDER BY id', (value,))
+        return [(row[0], json.loads(row[1])) for row in cursor]
+
+    def find_device(self, deviceid):
+        found = self.find_devices('id', deviceid)
+        return found[0] if found else None
@@ -0,0 +1,131 @@
+#
+#  framing.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from kexceptions import UpdaterException
+from imagesource import ImageSource
+
+BLOCK_SIZE = 1024
+
+BOOTLOADER_VID = 0x7722
+BOOTLOADER_HEADER = 65
+APP_HEADER = 4
+APP_REPORT_ID = 0x33 #OUTPUT Report ID
+
+ERASED_BLOCK = '\xFF' * BLOCK_SIZE
+
+def header_size(vid):
+    if vid == BOOTLOADER_VID:
+        return BOOTLOADER_HEADER
+    return APP_HEADER
+
+def is_erased(kb):
+    '''True if a block (str, bytearray or any buffer) is all 0xFF, which
+    is what erased flash reads as'''
+    if isinstance(kb, buffer):
+        kb = kb[:]
+    return kb == ERASED_BLOCK[:len(kb)]
+
+class ReportFramer:
+    '''Frames 1 KB blocks into HID output reports.
+
+    The report layout is chosen based on the VID. Reports are written into
+    a ring of preallocated buffers (one by default), so a returned report
+    is only valid until frame() has been called buffers more times.
+    '''
+    def __init__(self, vid, buffers=1):
+        self.vid = vid
+        self.header = header_size(vid)
+        self.ring = [bytearray(self.header + BLOCK_SIZE) for i in xrange(buffers)]
+        if self.header == APP_HEADER:
+            for buf in self.ring:
+                buf[0] = APP_REPORT_ID
+        self.next = 0
+
+    def frame(self, kb, packet_id, block_id):
+        '''Frame a block of data.
+
+        Keyword arguments:
+        kb -- up to 1KB of data (str, bytearray or any buffer), or None for
+            an all-zero payload
+        packet_id -- destination for the data
+        block_id -- first block is 0, so that the destination address is:
+            block_id * 1024
+        returns the framed report
+        '''
+        buf = self.ring[self.next]
+        self.next = (self.next + 1) % len(self.ring)
+        header = self.header
+        if header == BOOTLOADER_HEADER:
+            buf[1] = packet_id
+            buf[4] = packet_id
+            buf[5] = block_id & 0xFF
+            buf[6] = (block_id >> 8) & 0xFF
+        else:
+            buf[1] = packet_id
+            buf[2] = block_id & 0xFF
+            buf[3] = (block_id >> 8) & 0xFF
+        if kb is None:
+            buf[header:] = bytearray(BLOCK_SIZE)
+            return buf
+        n = len(kb)
+        buf[header:header+n] = kb
+        if n == BLOCK_SIZE:
+            return buf
+        # Only the final block of an image is short
+        return buf[:header+n]
+
+class FramedImage:
+    '''An image framed once for a given VID and destination.
+
+    The reports can be replayed to any number of devices with the same VID
+    via USBUpdater.framed_update() without framing them again.
+    '''
+    def __init__(self, vid, memory, packet_id, offset=0, first_block=0):
+        self.vid = vid
+        self.packet_id = packet_id
+        self.first_block = first_block
+        source = ImageSource.wrap(memory, offset)
+        self.size = len(source)
+        self.reports = []
+        framer = ReportFramer(vid)
+        block_id = first_block
+        for kb in source.blocks():
+            self.reports.append(bytearray(framer.frame(kb, packet_id, block_id)))
+            block_id += 1
+
+    @classmethod
+    def fromfile(cls, vid, file, packet_id, offset=0, first_block=0):
+        with ImageSource.fromfile(file, offset) as source:
+            return cls(vid, source, packet_id, 0, first_block)
+
+    def __len__(self):
+        return len(self.reports)
+
+    def check_vid(self, vid):
+        if header_size(vid) != header_size(self.vid):
+            raise UpdaterException('Image framed for VID ' + hex(self.vid) +
+                    ' cannot be sent to VID ' + hex(vid))
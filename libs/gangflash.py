@@ -0,0 +1,129 @@
+#
+#  gangflash.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from multiprocessing.pool import ThreadPool
+from framing import FramedImage
+from discovery import DeviceIndex, DASH_MODES
+import time
+
+class GangResult:
+    def __init__(self, device):
+        self.vid = device.vid
+        self.pid = device.pid
+        self.path = device.path
+        self.serial = device.serial
+        self.ok = False
+        self.error = None
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        status = 'ok' if self.ok else 'FAILED'
+        if self.error:
+            status += ' (' + str(self.error) + ')'
+        return '%04x:%04x %s serial %s: %s in %.1fs' % (self.vid, self.pid,
+                self.path, self.serial, status, self.elapsed)
+
+class GangFlasher:
+    '''Runs the same USBUpdater operation on every connected Dash at once.
+
+    Devices are told apart by their HID path, and each one gets its own
+    USBUpdater on a worker thread, so N boards take about as long as one.
+    '''
+    def __init__(self, modes=DASH_MODES, debug=False, workers=None, backend=None,
+            index=None):
+        if index is None:
+            index = DeviceIndex(modes, backend, debug=debug)
+        self.index = index
+        self.debug = debug
+        self.workers = workers
+        self.backend = backend
+        self.devices = None
+
+    def enumerate(self):
+        self.devices = self.index.all()
+        return self.devices
+
+    def run(self, operation):
+        '''Call operation(updater) for every device.
+
+        Returns a list of GangResult, one per device, in enumeration order.
+        '''
+        if self.devices is None:
+            self.enumerate()
+        if not self.devices:
+            return []
+
+        def worker(device):
+            result = GangResult(device)
+            updater = device.updater(self.debug, self.backend)
+            start = time.time()
+            try:
+                result.ok = bool(operation(updater))
+            except Exception as e:
+                result.error = e
+            result.elapsed = time.time() - start
+            return result
+
+        pool = ThreadPool(self.workers or len(self.devices))
+        try:
+            return pool.map(worker, self.devices)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _frame_per_vid(self, file, packet_id):
+        # Frame the image once per report layout, not once per device
+        if self.devices is None:
+            self.enumerate()
+        images = {}
+        for device in self.devices:
+            if device.vid not in images:
+                images[device.vid] = FramedImage.fromfile(device.vid, file, packet_id)
+        return images
+
+    def _flash(self, file, packet_id, reset):
+        images = self._frame_per_vid(file, packet_id)
+        def flash(updater):
+            if not updater.framed_update(images[updater.vid]):
+                return False
+            if reset:
+                updater.reset_all()
+            return True
+        return self.run(flash)
+
+    def update_user(self, file, reset=False):
+        return self._flash(file, 0x18, reset)
+
+    def update_system(self, file, reset=False):
+        return self._flash(file, 0x3C, reset)
+
+    def reset_all(self):
+        def reset(updater):
+            updater.reset_all()
+            return True
+        return self.run(reset)
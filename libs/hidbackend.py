@@ -0,0 +1,55 @@
+#
+#  hidbackend.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+class HIDAPIBackend:
+    '''Talks to real devices through the hidapi module'''
+    def __init__(self):
+        import hid
+        self.hid = hid
+
+    def device(self):
+        return self.hid.device()
+
+    def enumerate(self, vid=0, pid=0):
+        return self.hid.enumerate(vid, pid)
+
+_default_backend = None
+
+def get_default_backend():
+    '''The backend USBUpdater uses unless given another one. hidapi is
+    only imported the first time a real device is needed.
+    '''
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = HIDAPIBackend()
+    return _default_backend
+
+def set_default_backend(backend):
+    '''Replace hidapi for every USBUpdater, e.g. with an EmulatorBackend'''
+    global _default_backend
+    _default_backend = backend
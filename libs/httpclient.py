@@ -0,0 +1,98 @@
+#
+#  httpclient.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from kexceptions import UpdaterException
+from requests.adapters import HTTPAdapter
+import requests
+import threading
+
+try:
+    from hyper.contrib import HTTP20Adapter
+except ImportError:
+    HTTP20Adapter = None
+
+POOL_SIZE = 8
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+class HTTPClient:
+    '''A pooled requests.Session that all network traffic goes through.
+
+    Connections are kept alive and reused between requests to the same
+    host, up to pool_size of them per host, so paging through the API or
+    fetching several images doesn't handshake again for every request.
+    Every request gets timeout (seconds, or a (connect, read) tuple) unless
+    it passes its own. With http2, https URLs go over HTTP/2 through the
+    hyper package, which has to be installed.
+    '''
+    def __init__(self, pool_size=POOL_SIZE,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), http2=False, debug=False):
+        self.timeout = timeout
+        self.debug = debug
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if http2:
+            if HTTP20Adapter is None:
+                raise UpdaterException('HTTP/2 needs the hyper package')
+            self.session.mount('https://', HTTP20Adapter())
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.debug: print method, url
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def get_default_client():
+    '''The HTTPClient shared by everything that doesn't get another one.
+    Created on first use, from any thread.
+    '''
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HTTPClient()
+        return _default_client
+
+def set_default_client(client):
+    '''Replace the shared HTTPClient, e.g. with one using HTTP/2'''
+    global _default_client
+    with _default_lock:
+        _default_client = client
@@ -0,0 +1,108 @@
+#
+#  imagesource.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import mmap
+
+BLOCK_SIZE = 1024
+
+class ImageSource:
+    '''Read-only image data that can be sliced without copying.
+
+    Files are memory mapped, and in-memory images (str, bytearray or any
+    other buffer) are wrapped as they are, so blocks handed out by view()
+    and blocks() never copy the image. offset skips the start of the data.
+    '''
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.offset = offset
+        self.f = None
+        try:
+            self._view = memoryview(data)
+        except TypeError:
+            # mmap (and old style buffers) only have the old buffer
+            # interface, which buffer() slices without copying
+            self._view = None
+
+    @classmethod
+    def fromfile(cls, file, offset=0):
+        return cls.fromfileobj(open(file, 'rb'), offset)
+
+    @classmethod
+    def fromfileobj(cls, f, offset=0):
+        '''Map an open file, which is closed along with the source'''
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # Empty files can't be mapped
+            f.seek(0)
+            data = f.read()
+        source = cls(data, offset)
+        source.f = f
+        return source
+
+    @classmethod
+    def frommemory(cls, memory, offset=0):
+        return cls(memory, offset)
+
+    @classmethod
+    def wrap(cls, image, offset=0):
+        if isinstance(image, ImageSource):
+            return image
+        return cls.frommemory(image, offset)
+
+    def __len__(self):
+        return max(len(self.data) - self.offset, 0)
+
+    def view(self, start, size):
+        '''Zero-copy slice of size bytes (or fewer at the end) from start'''
+        start += self.offset
+        if self._view is not None:
+            return self._view[start:start+size]
+        return buffer(self.data, start, size)
+
+    def read(self, start, size):
+        '''Like view(), but returns a str copy, e.g. to compare small tags'''
+        start += self.offset
+        return self.data[start:start+size]
+
+    def blocks(self, size=BLOCK_SIZE):
+        for start in xrange(0, len(self), size):
+            yield self.view(start, size)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,203 @@
+#
+#  manifest.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from cachedir import get_cache_dir, replace_file, JSONStore
+from httpclient import get_default_client
+from usbupdater import DashVersion, DashVersions, DashVersionTable
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+class FirmwareManifest(object):
+    '''The parsed version.json of an update URL'''
+    __slots__ = ('system_firmware_version', 'system_firmware_url',
+            'boot_version', 'boot_url')
+
+    def __init__(self, system_firmware_version, system_firmware_url,
+            boot_version, boot_url):
+        self.system_firmware_version = system_firmware_version
+        self.system_firmware_url = system_firmware_url
+        self.boot_version = boot_version
+        self.boot_url = boot_url
+
+    @classmethod
+    def fromjson(cls, update_url, data):
+        firmware = DashVersion.fromstring(data['system_firmware_version'])
+        boot = DashVersion.fromstring(data['boot_version'])
+        return cls(firmware,
+                update_url + '/' + data['system_firmware_location'] + str(firmware) + '.bin',
+                boot,
+                update_url + '/' + data['boot_location'] + str(boot) + '.bin')
+
+    def is_current(self, versions):
+        '''True if a device with these DashVersions needs no upgrade'''
+        return versions.boot() >= self.boot_version and \
+                versions.system_firmware >= self.system_firmware_version
+
+    def __repr__(self):
+        return 'boot ' + str(self.boot_version) + ' ' + self.boot_url + \
+        ' system_firmware ' + str(self.system_firmware_version) + ' ' + \
+        self.system_firmware_url
+
+class ManifestCache:
+    '''version.json of an update URL, cached on disk for ttl seconds.
+
+    Past the TTL the manifest is revalidated with If-None-Match, and if the
+    server can't be reached the last copy is used anyway.
+    '''
+    def __init__(self, update_url, ttl=3600, filename=None, debug=False):
+        if filename is None:
+            name = hashlib.sha1(update_url).hexdigest() + '.json'
+            try:
+                filename = os.path.join(get_cache_dir('manifest'), name)
+            except OSError as e:
+                # Still usable, just without a disk copy
+                if debug: print 'manifest cache unavailable:', e
+        self.update_url = update_url
+        self.ttl = ttl
+        self.filename = filename
+        self.debug = debug
+
+    def load(self):
+        if self.filename is None:
+            return None
+        try:
+            with open(self.filename, 'rb') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def save(self, entry):
+        if self.filename is None:
+            return
+        # A file of its own, so concurrent updaters don't clobber it
+        try:
+            fd, tmp = tempfile.mkstemp(suffix='.tmp',
+                    dir=os.path.dirname(self.filename))
+        except (IOError, OSError) as e:
+            if self.debug: print 'manifest not cached:', e
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                json.dump(entry, f)
+            replace_file(tmp, self.filename)
+        except (IOError, OSError) as e:
+            if self.debug: print 'manifest not cached:', e
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def parse(self, entry):
+        return FirmwareManifest.fromjson(self.update_url, entry['data'])
+
+    def cached(self, fresh_only=True):
+        '''The cached manifest, or None if there is none (or it's past the
+        TTL and fresh_only is set)
+        '''
+        entry = self.load()
+        if entry is None:
+            return None
+        if fresh_only and time.time() - entry['fetched'] > self.ttl:
+            return None
+        return self.parse(entry)
+
+    def fetch(self, force=False):
+        '''Returns the FirmwareManifest, from the cache while it's fresh.
+        None if it can't be fetched and nothing is cached
+        '''
+        entry = self.load()
+        if entry is not None and not force and \
+                time.time() - entry['fetched'] <= self.ttl:
+            if self.debug: print 'manifest from cache'
+            return self.parse(entry)
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        try:
+            r = get_default_client().get(self.update_url + '/version.json',
+                    headers=headers)
+        except Exception as e:
+            if self.debug: print 'manifest fetch failed:', e
+            if entry is None:
+                return None
+            return self.parse(entry)
+        if r.status_code == 304 and entry is not None:
+            if self.debug: print 'manifest not modified'
+        elif r.ok:
+            entry = {'data': r.json(), 'etag': r.headers.get('ETag')}
+        else:
+            if self.debug: print 'manifest fetch failed:', r.status_code
+            if entry is None:
+                return None
+            # Left stale, so the next run asks the server again
+            return self.parse(entry)
+        manifest = self.parse(entry)
+        entry['fetched'] = time.time()
+        self.save(entry)
+        return manifest
+
+class DeviceVersionRecord(JSONStore):
+    '''Last known DashVersions of every device, by serial number.
+
+    Lets the updater know what a board in bootloader mode (which can't
+    report its versions) was last running.
+    '''
+    def __init__(self, filename=None, debug=False):
+        if filename is None:
+            filename = os.path.join(get_cache_dir(), 'device_versions.json')
+        JSONStore.__init__(self, filename, 'device versions', debug)
+
+    def get(self, serial):
+        entry = self.entries.get(serial)
+        if entry is None:
+            return None
+        return DashVersions(DashVersion.fromstring(entry['user_boot']),
+                DashVersion.fromstring(entry['system_boot']),
+                DashVersion.fromstring(entry['system_firmware']))
+
+    def record(self, serial, versions):
+        self.update(serial, {
+            'user_boot': str(versions.user_boot),
+            'system_boot': str(versions.system_boot),
+            'system_firmware': str(versions.system_firmware),
+            'seen': time.time(),
+        })
+
+    def forget(self, serial):
+        '''Drop what is known about a device, e.g. once its system
+        partition has been flashed with an image of unknown version'''
+        self.update(serial, None)
+
+    def table(self):
+        '''Every recorded device in a DashVersionTable keyed by serial'''
+        table = DashVersionTable()
+        for serial in self.entries:
+            table.add(serial, self.get(serial))
+        return table
@@ -26,15 +26,25 @@
 # SOFTWARE.
 
 import requests
+import fnmatch
 import os.path
 import json
 from kexceptions import UpdaterException
+from httpclient import get_default_client
+from uploadindex import file_sha256
+from pagination import PagePrefetcher
+from functools import partial
+
+BATCH_SIZE = 100
+PAGE_SIZE = 1000
 
 class OTAUpdater:
     apibase = 'https://dashboard.hologram.io/api/1/'
     def __init__(self, imagefile):
         self.apikey = None
         self.imagefile = imagefile
+        self.http = get_default_client()
+        self.upload_index = None
 
     def set_apikey(self, apikey):
         self.apikey = apikey
@@ -42,58 +52,62 @@ class OTAUpdater:
     def set_apibase(self, apibase):
         self.apibase = apibase
 
+    def set_http_client(self, http):
+        self.http = http
+
+    def set_upload_index(self, upload_index):
+        self.upload_index = upload_index
+
     def load_userinfo(self):
         apiurl = self.apibase + 'users/me/'
         url_params = {'apikey' : self.apikey}
-        r = requests.get(apiurl, params=url_params)
+        r = self.http.get(apiurl, params=url_params)
         if r.status_code != requests.codes.ok:
             raise UpdaterException('Error connecting to API: ' + r.text)
         else:
             resp = r.json();
             return resp['data']
 
-    def load_devices(self, orgid):
-        apiurl = self.apibase + 'devices/'
-        url_params = {'apikey' : self.apikey, 'orgid' : orgid,
-                      'limit' : 1000}
-        devices = []
-        while True:
-          r = requests.get(apiurl, params=url_params)
-          if r.status_code != requests.codes.ok:
-              raise UpdaterException('Error connecting to API: ' + r.text)
-          else:
-              resp = r.json();
-              data = resp['data']
-              devices += data
-
-              if (len(data) < 1000):
-                  break
-              else:
-                  url_params['startafter'] = data[-1]['id']
-        return devices
+    def fetch_page(self, apiurl, url_params, startafter):
+        url_params = dict(url_params, limit=PAGE_SIZE)
+        if startafter is not None:
+            url_params['startafter'] = startafter
+        r = self.http.get(apiurl, params=url_params)
+        if r.status_code != requests.codes.ok:
+            raise UpdaterException('Error connecting to API: ' + r.text)
+        return r.json()['data']
 
+    def iter_devices(self, orgid, startafter=None):
+        '''Generates the devices of an organization (only those with IDs
+        above startafter, if given) as pages arrive, with the next page
+        fetched in the background'''
+        url_params = {'apikey' : self.apikey, 'orgid' : orgid}
+        return iter(PagePrefetcher(
+            partial(self.fetch_page, self.apibase + 'devices/', url_params),
+            PAGE_SIZE, start=startafter))
 
-    def load_orgs(self, userid):
-        apiurl = self.apibase + 'organizations/'
-        url_params = {'apikey' : self.apikey, 'userid' : userid,
-                      'limit' : 1000}
-        orgs = []
-        while True:
-          r = requests.get(apiurl, params=url_params)
-          if r.status_code != requests.codes.ok:
-              raise UpdaterException('Error connecting to API: ' + r.text)
-          else:
-              resp = r.json();
-              data = resp['data']
-              orgs += data
-
-              if (len(data) < 1000):
-                  break
-              else:
-                  url_params['startafter'] = data[-1]['id']
-        return orgs
+    def iter_orgs(self, userid, startafter=None):
+        url_params = {'apikey' : self.apikey, 'userid' : userid}
+        return iter(PagePrefetcher(
+            partial(self.fetch_page, self.apibase + 'organizations/', url_params),
+            PAGE_SIZE, start=startafter))
 
+    def load_devices(self, orgid):
+        return list(self.iter_devices(orgid))
 
+    def load_orgs(self, userid):
+        return list(self.iter_orgs(userid))
+
+    def find_device(self, orgid, deviceid):
+        '''The device with ID deviceid, without loading the pages after it'''
+        devices = self.iter_devices(orgid)
+        try:
+            for device in devices:
+                if device['id'] == deviceid:
+                    return device
+        finally:
+            devices.close()
+        return None
 
     def get_orgs(self):
         userinfo = self.load_userinfo()
@@ -105,35 +119,135 @@ class OTAUpdater:
         return devices
 
 
-    def update(self, deviceid, orgid):
+    def check_imagefile(self):
         if(not os.path.exists(self.imagefile) or
                 not os.path.isfile(self.imagefile)):
             raise IOError('Image file %s does not exist' % self.imagefile)
-        print("Pushing firmware to device ID #%d" % deviceid)
-        #upload image
+
+    def upload_image(self, orgid):
+        '''Upload the image file, returns the firmware image ID. With an
+        upload index, an image already uploaded to the organization is
+        reused if the API still has it'''
+        digest = None
+        if self.upload_index is not None:
+            digest = file_sha256(self.imagefile)
+            fwid = self.upload_index.get(orgid, digest)
+            if fwid is not None:
+                if self.image_exists(fwid, orgid):
+                    print("Reusing firmware ID #%d" % fwid)
+                    return fwid
+                self.upload_index.forget(orgid, digest)
         apiurl = self.apibase + 'firmwareimages/'
         url_params = {'apikey' : self.apikey, 'orgid' : orgid}
         fname = os.path.basename(self.imagefile)
-        files = {'imagefile': (fname, open(self.imagefile, 'rb'),
-            'application/octet-stream')}
         print("Uploading")
-        r = requests.post(apiurl, files=files, params=url_params)
+        with open(self.imagefile, 'rb') as f:
+            files = {'imagefile': (fname, f, 'application/octet-stream')}
+            r = self.http.post(apiurl, files=files, params=url_params)
         if r.status_code != requests.codes.ok:
             raise UpdaterException('Error uploading image: ' + r.text)
         resp = r.json()
         imageobj = resp['data']
         fwid = imageobj['id']
         print("Firmware ID #%d created" % fwid)
-        print("Executing push to device")
+        if digest is not None:
+            self.upload_index.record(orgid, digest, fwid)
+        return fwid
+
+    def image_exists(self, fwid, orgid):
+        apiurl = self.apibase + 'firmwareimages/' + str(fwid)
+        url_params = {'apikey' : self.apikey, 'orgid' : orgid}
+        r = self.http.get(apiurl, params=url_params)
+        return r.status_code == requests.codes.ok
+
+    def send_image(self, fwid, deviceids, orgid):
+        url_params = {'apikey' : self.apikey, 'orgid' : orgid}
         sendurl = self.apibase + 'firmwareimages/' + str(fwid) + '/send'
-        payload = { 'deviceids': [deviceid] }
+        payload = { 'deviceids': list(deviceids) }
         headers = {'Content-Type':'application/json'}
-        r = requests.post(sendurl,
+        r = self.http.post(sendurl,
                 params=url_params,
                 data=json.dumps(payload),
                 headers=headers)
         if r.status_code != requests.codes.ok:
             raise UpdaterException('Error pushing image: ' + r.text)
-        print("OTA update sent")
 
+    def update(self, deviceid, orgid):
+        self.check_imagefile()
+        print("Pushing firmware to device ID #%d" % deviceid)
+        #upload image
+        fwid = self.upload_image(orgid)
+        print("Executing push to device")
+        self.send_image(fwid, [deviceid], orgid)
+        print("OTA update sent")
 
+    def bulk_update(self, deviceids, orgid, batch_size=BATCH_SIZE):
+        '''Upload the image once and send it to deviceids batch_size at a
+        time. A failed batch doesn't stop the ones after it.
+
+        returns a BatchResult for every batch
+        '''
+        self.check_imagefile()
+        deviceids = list(deviceids)
+        print("Pushing firmware to %d devices" % len(deviceids))
+        fwid = self.upload_image(orgid)
+        batches = [deviceids[i:i+batch_size]
+                for i in xrange(0, len(deviceids), batch_size)]
+        results = []
+        for number, batch in enumerate(batches, 1):
+            result = BatchResult(number, batch)
+            try:
+                self.send_image(fwid, batch, orgid)
+            except Exception as e:
+                result.error = e
+            results.append(result)
+            print("Batch %d/%d: %s" % (number, len(batches), result))
+        return results
+
+class BatchResult:
+    def __init__(self, number, deviceids):
+        self.number = number
+        self.deviceids = deviceids
+        self.error = None
+
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok():
+            return '%d devices sent' % len(self.deviceids)
+        return '%d devices failed: %s' % (len(self.deviceids), self.error)
+
+def read_device_list(filename):
+    '''Device IDs from a file, one per line. Blank lines and anything after
+    a # are ignored'''
+    deviceids = []
+    with open(filename, 'r') as f:
+        for number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if not line.isdigit():
+                raise UpdaterException('%s:%d: invalid device ID %r' %
+                        (filename, number, line))
+            deviceids.append(int(line))
+    return deviceids
+
+def filter_devices(devices, filters):
+    '''The devices from load_devices() matching every filter, each one a
+    KEY=PATTERN string where PATTERN is a shell style wildcard matched
+    against the device's KEY field, e.g. name=field-unit-*'''
+    matchers = []
+    for f in filters:
+        key, sep, pattern = f.partition('=')
+        if not sep or not key:
+            raise UpdaterException('Invalid device filter %r, expected '
+                    'KEY=PATTERN' % f)
+        matchers.append((key, pattern))
+    def matches(device):
+        for key, pattern in matchers:
+            value = device.get(key)
+            if value is None or not fnmatch.fnmatchcase(unicode(value), pattern):
+                return False
+        return True
+    return [device for device in devices if matches(device)]
@@ -0,0 +1,92 @@
+#
+#  pagination.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import Queue
+import sys
+import threading
+
+class PagePrefetcher:
+    '''Iterates over the items of a paginated API listing, fetching the
+    next page on a background thread while the current one is consumed.
+
+    fetch_page(startafter) returns a list of items, startafter being start
+    (None for the beginning of the listing) for the first page and the key
+    of the last item seen after that. A page
+    shorter than page_size is the last one. At most depth pages are waiting
+    at any time. Every iteration starts a new listing, and stopping an
+    iteration early (break, or closing the generator) stops its worker once
+    the request in flight returns.
+    '''
+    def __init__(self, fetch_page, page_size, depth=2, key='id', start=None):
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.depth = depth
+        self.key = key
+        self.start = start
+
+    def __iter__(self):
+        pages = Queue.Queue(self.depth)
+        stop = threading.Event()
+        worker = threading.Thread(target=self.run, args=(pages, stop))
+        worker.daemon = True
+        worker.start()
+        try:
+            while True:
+                kind, value = pages.get()
+                if kind == 'page':
+                    for item in value:
+                        yield item
+                elif kind == 'error':
+                    raise value[0], value[1], value[2]
+                else:
+                    return
+        finally:
+            stop.set()
+
+    def run(self, pages, stop):
+        startafter = self.start
+        try:
+            while not stop.is_set():
+                page = self.fetch_page(startafter)
+                self.put(pages, stop, ('page', page))
+                if len(page) < self.page_size:
+                    break
+                startafter = page[-1][self.key]
+        except:
+            self.put(pages, stop, ('error', sys.exc_info()))
+            return
+        self.put(pages, stop, ('done', None))
+
+    def put(self, pages, stop, message):
+        # Wait for room, unless the consumer has gone away
+        while not stop.is_set():
+            try:
+                pages.put(message, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
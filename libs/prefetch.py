@@ -0,0 +1,87 @@
+#
+#  prefetch.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import sys
+import threading
+
+class Prefetch:
+    '''Calls func(*args) on a background thread.
+
+    result() waits for it and returns its return value, or re-raises what
+    it raised. Nothing waits for a prefetch that is never asked for:
+    discard() hands its value to cleanup as soon as it is ready instead.
+    '''
+    def __init__(self, func, *args):
+        self.value = None
+        self.exc_info = None
+        self.finished = False
+        self.discarded = False
+        self.cleanup = None
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, args=(func, args))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, func, args):
+        try:
+            self.value = func(*args)
+        except:
+            self.exc_info = sys.exc_info()
+        with self.lock:
+            self.finished = True
+            cleanup = self.cleanup
+        if cleanup is not None:
+            self.dispose(cleanup)
+
+    def dispose(self, cleanup):
+        if self.value is not None:
+            cleanup(self.value)
+        self.value = None
+
+    def discard(self, cleanup=None):
+        '''Give up on the result without waiting for it. cleanup(value)
+        is called once a result is there, on whichever thread gets to it
+        first'''
+        with self.lock:
+            self.discarded = True
+            if not self.finished:
+                self.cleanup = cleanup
+                return
+        if cleanup is not None:
+            self.dispose(cleanup)
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def result(self):
+        if self.discarded:
+            raise ValueError('prefetch was discarded')
+        self.thread.join()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
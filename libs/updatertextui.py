@@ -42,12 +42,13 @@ class UpdaterTextUI:
         print("Available devices: ")
         result = None
         deviceids = []
-        if not devices:
+        # devices may be a generator still loading pages, print as they come
+        for device in devices:
+            deviceids.append(device['id'])
+            print("  ID#%d - %s"%(device['id'], device['name']))
+        if not deviceids:
             print("  [NONE]")
         else:
-            for device in devices:
-                deviceids.append(device['id'])
-                print("  ID#%d - %s"%(device['id'], device['name']))
             while True:
                 deviceid = raw_input("Enter device ID to update: ")
                 if not deviceid.isdigit():
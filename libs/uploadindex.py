@@ -0,0 +1,69 @@
+#
+#  uploadindex.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from cachedir import get_cache_dir, JSONStore
+import hashlib
+import os
+import time
+
+def file_sha256(filename):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class UploadIndex(JSONStore):
+    '''Remembers the firmware image ID the API gave each uploaded image.
+
+    Entries are keyed by API base, organization and the sha256 of the
+    image, so pushing the same bytes again can reuse the image instead of
+    uploading it a second time. Image IDs of one server (say production)
+    are never looked up on another (say staging).
+    '''
+    def __init__(self, apibase, filename=None, debug=False):
+        if filename is None:
+            filename = os.path.join(get_cache_dir(), 'uploaded_images.json')
+        JSONStore.__init__(self, filename, 'upload index', debug)
+        self.apibase = apibase
+
+    def _key(self, orgid, digest):
+        return '%s %s:%s' % (self.apibase, orgid, digest)
+
+    def get(self, orgid, digest):
+        entry = self.entries.get(self._key(orgid, digest))
+        if entry is None:
+            return None
+        return entry['id']
+
+    def record(self, orgid, digest, fwid):
+        self.update(self._key(orgid, digest), {'id': fwid,
+                'uploaded': time.time()})
+
+    def forget(self, orgid, digest):
+        self.update(self._key(orgid, digest), None)
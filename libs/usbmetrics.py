@@ -0,0 +1,154 @@
+#
+#  usbmetrics.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import time
+
+# Latency histogram bucket upper bounds, in microseconds
+HISTOGRAM_BOUNDS = [2 ** i for i in range(6, 21)]
+
+class PartitionMetrics:
+    def __init__(self, packet_id):
+        self.packet_id = packet_id
+        self.blocks = 0
+        self.bytes = 0
+        self.failed = 0
+        self.erased_blocks = 0
+        self.erased_bytes = 0
+        self.elided_blocks = 0
+        self.elided_bytes = 0
+        self.write_time = 0.0
+        self.first_write = None
+        self.last_write = None
+        self.latencies = []
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+    def record(self, block_id, nbytes, start, latency, ok):
+        if self.first_write is None:
+            self.first_write = start
+        self.last_write = start + latency
+        self.write_time += latency
+        self.latencies.append((block_id, latency))
+        us = latency * 1000000
+        bucket = 0
+        while bucket < len(HISTOGRAM_BOUNDS) and us > HISTOGRAM_BOUNDS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+        if ok:
+            self.blocks += 1
+            self.bytes += nbytes
+        else:
+            self.failed += 1
+
+    def record_erased(self, nbytes, elided):
+        self.erased_blocks += 1
+        self.erased_bytes += nbytes
+        if elided:
+            self.elided_blocks += 1
+            self.elided_bytes += nbytes
+
+    def as_dict(self):
+        elapsed = 0.0
+        if self.first_write is not None:
+            elapsed = self.last_write - self.first_write
+        latencies = [latency for block_id, latency in self.latencies]
+        histogram = {}
+        for i, count in enumerate(self.histogram):
+            if count:
+                if i < len(HISTOGRAM_BOUNDS):
+                    histogram['<=' + str(HISTOGRAM_BOUNDS[i]) + 'us'] = count
+                else:
+                    histogram['>' + str(HISTOGRAM_BOUNDS[-1]) + 'us'] = count
+        return {
+            'packet_id': hex(self.packet_id),
+            'blocks': self.blocks,
+            'bytes': self.bytes,
+            'failed_writes': self.failed,
+            'erased_blocks': self.erased_blocks,
+            'erased_bytes': self.erased_bytes,
+            'elided_blocks': self.elided_blocks,
+            'elided_bytes': self.elided_bytes,
+            'write_time': self.write_time,
+            'elapsed': elapsed,
+            'write_bytes_per_second': self.bytes / self.write_time if self.write_time else 0,
+            'bytes_per_second': self.bytes / elapsed if elapsed else 0,
+            'min_latency': min(latencies) if latencies else 0,
+            'max_latency': max(latencies) if latencies else 0,
+            'mean_latency': sum(latencies) / len(latencies) if latencies else 0,
+            'latency_histogram': histogram,
+            'block_latencies': self.latencies,
+        }
+
+class FlashMetrics:
+    '''Write timings of every HID report sent during a flash session.
+
+    Set on a USBUpdater with set_metrics(). When no metrics object is set
+    the write path doesn't read the clock at all.
+    '''
+    def __init__(self):
+        self.started = time.time()
+        self.partitions = {}
+
+    def record(self, packet_id, block_id, nbytes, start, latency, ok):
+        self.partition(packet_id).record(block_id, nbytes, start, latency, ok)
+
+    def partition(self, packet_id):
+        partition = self.partitions.get(packet_id)
+        if partition is None:
+            partition = self.partitions[packet_id] = PartitionMetrics(packet_id)
+        return partition
+
+    def record_erased(self, packet_id, nbytes, elided):
+        '''Count an erased (all 0xFF) block of an image, and whether it was
+        elided instead of sent'''
+        self.partition(packet_id).record_erased(nbytes, elided)
+
+    def as_dict(self):
+        return {
+            'started': self.started,
+            'partitions': [self.partitions[p].as_dict()
+                for p in sorted(self.partitions)],
+        }
+
+    def dump_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def __repr__(self):
+        lines = []
+        for p in sorted(self.partitions):
+            d = self.partitions[p].as_dict()
+            lines.append('%s: %d blocks, %d bytes, %d failed, %.0f B/s, '
+                    'latency %.2f/%.2f/%.2f ms min/mean/max, '
+                    '%d of %d erased blocks elided (%d bytes)' % (
+                    d['packet_id'], d['blocks'], d['bytes'],
+                    d['failed_writes'], d['bytes_per_second'],
+                    d['min_latency'] * 1000, d['mean_latency'] * 1000,
+                    d['max_latency'] * 1000, d['elided_blocks'],
+                    d['erased_blocks'], d['elided_bytes']))
+        return '\n'.join(lines)
@@ -0,0 +1,95 @@
+#
+#  usbpipeline.py
+#
+# Author: Hologram <support@hologram.io>
+#
+# License: Copyright (c) 2017 Konekt, Inc. All Rights Reserved.
+#
+# Released under the MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import Queue
+import threading
+
+class PipelinedWriter:
+    '''Writes framed reports to the device from a dedicated thread.
+
+    The caller frames blocks ahead and hands them over with put(), which
+    blocks once depth reports are queued. The first block that can't be
+    written (after USBUpdater.send_retry()'s retries) stops the writer, and
+    nothing queued after it is written.
+
+    Reports must stay untouched until written, so the caller has to frame
+    into at least depth + 2 buffers (see ReportFramer's buffers argument).
+    '''
+    def __init__(self, updater, packet_id, depth):
+        self.updater = updater
+        self.packet_id = packet_id
+        self.queue = Queue.Queue(depth)
+        self.failed = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        updater = self.updater
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                block_id, block = item
+                if not updater.send_retry(block, self.packet_id, block_id):
+                    self.failed.set()
+                    break
+                updater.block_acked(block_id)
+        except Exception as e:
+            self.error = e
+            self.failed.set()
+
+    def put(self, block_id, block):
+        '''Queue a report. Returns False once the writer has stopped on an
+        error, after which nothing else should be queued
+        '''
+        while not self.failed.is_set():
+            try:
+                self.queue.put((block_id, block), timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def finish(self):
+        '''Wait for everything queued to be written. Returns True if it was'''
+        while not self.failed.is_set():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except Queue.Full:
+                pass
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return not self.failed.is_set()
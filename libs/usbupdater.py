@@ -25,19 +25,54 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import hid
 from kexceptions import *
+from hidbackend import get_default_backend
+from framing import ReportFramer, FramedImage, header_size, is_erased
+from flashledger import block_hashes
+from imagesource import ImageSource
+from usbpipeline import PipelinedWriter
+from timeit import default_timer as timer
+from array import array
+from functools import partial
+from itertools import compress, izip
+from operator import gt
+import contextlib
+import threading
 import time
 
-class DashVersion:
-    major = 0
-    minor = 0
-    revision = 0
+# hid_init()/hid_open() are not safe to call from several threads at once
+_open_lock = threading.Lock()
 
-    def __init__(self, major=0, minor=0, revision=0):
-        self.major = major
-        self.minor = minor
-        self.revision = revision
+# Fixed wait after a reset when re-enumeration isn't polled
+RESET_DELAY = 2
+
+class DashVersion(object):
+    '''An immutable major.minor.revision version.
+
+    Instances are interned, so equal versions are usually the same object,
+    and the packed int used for comparisons and hashing is computed once.
+    '''
+    __slots__ = ('major', 'minor', 'revision', 'value')
+    _interned = {}
+
+    def __new__(cls, major=0, minor=0, revision=0):
+        key = (cls, major, minor, revision)
+        version = cls._interned.get(key)
+        if version is None:
+            version = object.__new__(cls)
+            object.__setattr__(version, 'major', major)
+            object.__setattr__(version, 'minor', minor)
+            object.__setattr__(version, 'revision', revision)
+            object.__setattr__(version, 'value', ((major & 0xFF) << 16) |
+                    ((minor & 0xFF) << 8) | (revision & 0xFF))
+            version = cls._interned.setdefault(key, version)
+        return version
+
+    def __setattr__(self, name, value):
+        raise AttributeError('DashVersion is immutable')
+
+    def __reduce__(self):
+        return (self.__class__, (self.major, self.minor, self.revision))
 
     @classmethod
     def fromlist(cls, lst):
@@ -47,54 +82,65 @@ class DashVersion:
     def fromstring(cls, s):
         return cls(*(map(int, s.split('.'))))
 
+    @classmethod
+    def fromint(cls, value):
+        return cls((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF)
+
     def get_int(self):
-        return ((self.major & 0xFF) << 16) | ((self.minor & 0xFF) << 8) | (self.revision & 0xFF)
+        return self.value
+
+    def __hash__(self):
+        return self.value
 
     def __repr__(self):
         return str(self.major) + '.' + str(self.minor) + '.' + str(self.revision)
 
     def __lt__(self, other):
         if isinstance(other, DashVersion):
-            return self.get_int() < other.get_int()
+            return self.value < other.value
         else:
             return NotImplemented
 
     def __le__(self, other):
         if isinstance(other, DashVersion):
-            return self.get_int() <= other.get_int()
+            return self.value <= other.value
         else:
             return NotImplemented
 
     def __eq__(self, other):
         if isinstance(other, DashVersion):
-            return self.get_int() == other.get_int()
+            return self.value == other.value
         else:
             return NotImplemented
 
     def __ne__(self, other):
         if isinstance(other, DashVersion):
-            return self.get_int() != other.get_int()
+            return self.value != other.value
         else:
             return NotImplemented
 
     def __gt__(self, other):
         if isinstance(other, DashVersion):
-            return self.get_int() > other.get_int()
+            return self.value > other.value
         else:
             return NotImplemented
 
     def __ge__(self, other):
         if isinstance(other, DashVersion):
-            return self.get_int() >= other.get_int()
+            return self.value >= other.value
         else:
             return NotImplemented
 
-class DashVersions:
-    user_boot = DashVersion()
-    system_boot = DashVersion()
-    system_firmware = DashVersion()
+class DashVersions(object):
+    __slots__ = ('user_boot', 'system_boot', 'system_firmware')
 
-    def __init__(self, user_boot=DashVersion(), system_boot=DashVersion(), system_firmware=DashVersion()):
+    def __init__(self, user_boot=None, system_boot=None, system_firmware=None):
+        if user_boot is None:
+            user_boot = DashVersion()
+        if system_boot is None:
+            system_boot = DashVersion()
+        if system_firmware is None:
+            system_firmware = DashVersion()
         if isinstance(user_boot, DashVersion):
             self.user_boot = user_boot
         else:
@@ -112,6 +158,10 @@ class DashVersions:
     def fromlist(cls, lst):
         return cls(DashVersion.fromlist(lst), DashVersion.fromlist(lst[6:]), DashVersion.fromlist(lst[9:]))
 
+    def boot(self):
+        '''The older of the two boot versions, which decides boot upgrades'''
+        return min(self.system_boot, self.user_boot)
+
     def __repr__(self):
         return 'user_boot: ' + str(self.user_boot) + \
         ' system_boot ' + str(self.system_boot) + \
@@ -125,15 +175,251 @@ class DashVersions:
         else:
             return NotImplemented
 
+class DashVersionTable(object):
+    '''DashVersions of many devices, stored as columns of packed ints.
+
+    Rows are keyed by anything hashable (a serial number, a device id).
+    Queries run over whole columns at once, so planning the upgrade of
+    thousands of devices is a single pass instead of one DashVersions
+    comparison per device.
+    '''
+    def __init__(self):
+        self.keys = []
+        self.rows = {}
+        self.user_boot = array('L')
+        self.system_boot = array('L')
+        self.system_firmware = array('L')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def add(self, key, versions):
+        row = self.rows.get(key)
+        if row is None:
+            self.rows[key] = len(self.keys)
+            self.keys.append(key)
+            self.user_boot.append(versions.user_boot.value)
+            self.system_boot.append(versions.system_boot.value)
+            self.system_firmware.append(versions.system_firmware.value)
+        else:
+            self.user_boot[row] = versions.user_boot.value
+            self.system_boot[row] = versions.system_boot.value
+            self.system_firmware[row] = versions.system_firmware.value
+
+    def get(self, key):
+        row = self.rows[key]
+        return DashVersions(DashVersion.fromint(self.user_boot[row]),
+                DashVersion.fromint(self.system_boot[row]),
+                DashVersion.fromint(self.system_firmware[row]))
+
+    def boot(self):
+        return map(min, self.user_boot, self.system_boot)
+
+    def needs_boot_upgrade(self, boot_version):
+        '''Keys of the devices whose older boot version is below boot_version'''
+        return list(compress(self.keys, map(partial(gt, boot_version.value), self.boot())))
+
+    def needs_firmware_upgrade(self, firmware_version):
+        return list(compress(self.keys,
+            map(partial(gt, firmware_version.value), self.system_firmware)))
+
+    def plan(self, boot_version, firmware_version):
+        '''Splits the devices like finish_update_usb() would: a boot upgrade
+        (which also brings the system firmware) where the boot is outdated,
+        otherwise a firmware upgrade where only the firmware is. Returns
+        {'boot': [keys], 'firmware': [keys]}
+        '''
+        boot = map(partial(gt, boot_version.value), self.boot())
+        firmware = map(partial(gt, firmware_version.value), self.system_firmware)
+        return {
+            'boot': list(compress(self.keys, boot)),
+            'firmware': list(compress(self.keys,
+                [f and not b for b, f in izip(boot, firmware)])),
+        }
+
+class SparseStats:
+    '''Erased (all 0xFF) blocks of the last flash, and how many of them
+    were elided instead of sent'''
+    def __init__(self):
+        self.total_blocks = 0
+        self.erased_blocks = 0
+        self.erased_bytes = 0
+        self.elided_blocks = 0
+        self.elided_bytes = 0
+
+    def add(self, nbytes, elided):
+        self.erased_blocks += 1
+        self.erased_bytes += nbytes
+        if elided:
+            self.elided_blocks += 1
+            self.elided_bytes += nbytes
+
+    def __repr__(self):
+        return '%d of %d blocks erased (%d bytes), %d elided (%d bytes)' % (
+                self.erased_blocks, self.total_blocks, self.erased_bytes,
+                self.elided_blocks, self.elided_bytes)
+
 class USBUpdater:
     def __init__(self, vid=0x7722, pid=0x1200, debug=False):
         self.debug = debug
         self.vid = vid
         self.pid = pid
+        self.path = None
+        self.h = None
+        self.ledger = None
+        self.sparse = False
+        self.sparse_stats = SparseStats()
+        self.set_reset_wait()
+        self.metrics = None
+        self.last_acked_block = None
+        self.set_retries(3)
+        self.pipeline_depth = 0
+        self.progress = None
+        self.composite = False
+        self.start_progress(0)
+        self.backend = None
+        self.index = None
+        self.framer = ReportFramer(vid)
 
     def set_ids(self, vid, pid):
+        self.close()
         self.vid = vid
         self.pid = pid
+        self.framer = ReportFramer(vid)
+
+    def set_backend(self, backend):
+        '''Use backend instead of hidapi, e.g. an EmulatorBackend. A backend
+        provides device() and enumerate(vid, pid) like the hid module does.
+        '''
+        self.close()
+        self.backend = backend
+
+    def set_index(self, index):
+        '''A DeviceIndex to invalidate whenever the device re-enumerates'''
+        self.index = index
+
+    def invalidate_index(self):
+        if self.index is not None:
+            self.index.invalidate()
+
+    def get_backend(self):
+        if self.backend is None:
+            return get_default_backend()
+        return self.backend
+
+    def set_path(self, path):
+        '''Open the device at this HID path instead of the first VID/PID match'''
+        self.close()
+        self.path = path
+
+    def set_ledger(self, ledger):
+        '''Keep a FlashLedger up to date with everything flashed'''
+        self.ledger = ledger
+
+    def set_sparse(self, sparse):
+        '''Let ledger_update() leave out erased (all 0xFF) blocks that the
+        FlashLedger records as already erased on the device, on full flashes
+        too. Blocks the ledger knows nothing about are always sent.
+        '''
+        self.sparse = sparse
+
+    def set_retries(self, retries, delay=0.1):
+        '''How many times a failed block write is retried, and how long to
+        wait before re-opening the device for each retry'''
+        self.retries = retries
+        self.retry_delay = delay
+
+    def set_pipeline_depth(self, depth):
+        '''Frame up to depth blocks ahead while a writer thread sends them,
+        so host-side work overlaps the USB writes. 0 writes from the calling
+        thread, one block at a time
+        '''
+        if depth < 0:
+            raise ValueError('pipeline depth must not be negative')
+        self.pipeline_depth = depth
+
+    def set_progress(self, progress):
+        '''Call progress(blocks_done, blocks_total) after every block written'''
+        self.progress = progress
+
+    def set_metrics(self, metrics):
+        '''Record every report write in a FlashMetrics, or None to stop'''
+        self.metrics = metrics
+
+    def forget_ledger(self, packet_id):
+        # Blocks written outside of ledger_update() invalidate the entry
+        if self.ledger is not None:
+            serial = self.get_serial()
+            if serial:
+                self.ledger.forget(serial, packet_id)
+
+    def open_device(self, h):
+        with _open_lock:
+            if self.path is not None:
+                h.open_path(self.path)
+            else:
+                h.open(self.vid, self.pid)
+
+    def open(self):
+        '''Open the device and keep the handle for the following operations
+        until close() is called. Raises IOError if the device can't be opened
+        '''
+        if self.h is None:
+            h = self.get_backend().device()
+            try:
+                self.open_device(h)
+            except:
+                h.close()
+                self.invalidate_index()
+                raise
+            self.h = h
+        return self.h
+
+    def try_open(self, vid=None, pid=None):
+        '''Like open(), but returns False instead of raising. If vid and pid
+        are given they replace the current ids only if the open succeeds
+        '''
+        old_ids = (self.vid, self.pid)
+        if vid is not None and pid is not None:
+            self.set_ids(vid, pid)
+        try:
+            self.open()
+        except:
+            if (self.vid, self.pid) != old_ids:
+                self.set_ids(*old_ids)
+            return False
+        return True
+
+    def reopen(self):
+        '''Replace the open handle with a fresh one, e.g. after a failed write'''
+        self.close()
+        return self.open()
+
+    def close(self):
+        if self.h is not None:
+            h = self.h
+            self.h = None
+            h.close()
+
+    @contextlib.contextmanager
+    def session(self):
+        '''Context manager yielding an open HID handle.
+
+        Every operation runs inside a session. If one is already open (via
+        open() or an outer session) its handle is reused, otherwise the
+        device is opened for the duration of the block only.
+        '''
+        if self.h is not None:
+            yield self.h
+            return
+        h = self.open()
+        try:
+            yield h
+        finally:
+            self.close()
 
     def send_kb(self, h, kb, packet_id, block_id):
         '''Send a 1 KB block of data.
@@ -141,25 +427,29 @@ class USBUpdater:
 
         Keyword arguments:
         h -- USB HID handle of the device
-        kb -- 1KB of string-based data
+        kb -- 1KB of data (str, bytearray or any buffer)
         packet_id -- destination for the data
         block_id -- first block is 0, so that the destination address is:
             block_id * 1024
         returns True if successful, False if not
         '''
-        if self.vid == 0x7722:
-            block = [0]*65 + [x for x in bytearray(kb)]
-            block[1] = packet_id
-            block[4] = packet_id
-            block[5] = block_id & 0xFF
-            block[6] = (block_id >> 8) & 0xFF
+        return self.send_report(h, self.framer.frame(kb, packet_id, block_id),
+                packet_id, block_id)
+
+    def send_report(self, h, block, packet_id, block_id):
+        '''Send an already framed report. See send_kb()'''
+        if self.metrics is None:
+            n = h.write(block)
         else:
-            block = [0]*4 + [x for x in bytearray(kb)]
-            block[0] = 0x33 #OUTPUT Report ID
-            block[1] = packet_id
-            block[2] = block_id & 0xFF
-            block[3] = (block_id >> 8) & 0xFF
-        n = h.write(block)
+            start = timer()
+            n = -1
+            try:
+                n = h.write(block)
+            finally:
+                # Payload only, so throughput adds up to the image size
+                self.metrics.record(packet_id, block_id,
+                        len(block) - self.framer.header, start,
+                        timer() - start, n != -1)
         if n == -1:
             if self.debug: print "block", block_id, "failed write to", hex(packet_id), n, len(block)
             return False
@@ -168,88 +458,308 @@ class USBUpdater:
                 print "block", block_id, "written to", hex(packet_id)
         return True
 
-    def memory_update(self, memory, packet_id, offset=0, first_block=0):
-        retval = True
-        h = hid.device()
+    def flash_source(self, source, packet_id, first_block=0, block_ids=None):
+        '''Send every 1 KB block of an ImageSource, or only the blocks listed
+        in block_ids. Every USB flash ends up here.
+
+        Failed blocks are retried (see set_retries()), and the flash carries
+        on from the failed block, never from the start. If it still fails,
+        last_acked_block holds the last block written.
+        '''
+        if not self.composite:
+            self.sparse_stats = SparseStats()
+            if block_ids is not None:
+                self.start_progress(len(block_ids))
+            else:
+                self.start_progress((len(source) + 1023) / 1024)
+        self.last_acked_block = None
+        depth = self.pipeline_depth
+        framer = ReportFramer(self.vid, depth + 2) if depth else self.framer
+        blocks = self.frame_blocks(framer, source, packet_id, first_block,
+                block_ids)
         try:
-            h.open(self.vid, self.pid)
-            block_id = first_block
-            while(retval):
-                start = ((block_id-first_block) * 1024) + offset
-                kb = memory[start:start+1024]
-                if(len(kb) == 0):
-                    break
-                retval = self.send_kb(h, kb, packet_id, block_id)
-                block_id += 1
-        except:
-            if self.debug: print "block write exception"
+            with self.session():
+                if depth:
+                    retval = self.write_pipelined(blocks, packet_id, depth)
+                else:
+                    retval = True
+                    for block_id, block in blocks:
+                        retval = self.send_retry(block, packet_id, block_id)
+                        if not retval:
+                            break
+                        self.block_acked(block_id)
+        except Exception as e:
+            if self.debug: print "block write exception", e
             return False
+        if self.debug and not self.composite: print 'sparse', self.sparse_stats
+        return retval
+
+    def frame_blocks(self, framer, source, packet_id, first_block, block_ids):
+        '''Yields (block_id, report) for every block flash_source() sends,
+        counting the erased blocks of the image on the way'''
+        block_id = first_block
+        for kb in source.blocks():
+            self.sparse_stats.total_blocks += 1
+            listed = block_ids is None or block_id in block_ids
+            if is_erased(kb):
+                self.count_erased(packet_id, len(kb), not listed)
+            if listed:
+                yield block_id, framer.frame(kb, packet_id, block_id)
+            block_id += 1
+
+    def count_erased(self, packet_id, nbytes, elided):
+        self.sparse_stats.add(nbytes, elided)
+        if self.metrics is not None:
+            self.metrics.record_erased(packet_id, nbytes, elided)
+
+    def write_pipelined(self, blocks, packet_id, depth):
+        writer = PipelinedWriter(self, packet_id, depth).start()
+        try:
+            for block_id, block in blocks:
+                if not writer.put(block_id, block):
+                    break
         finally:
-            h.close()
+            retval = writer.finish()
         return retval
 
+    def start_progress(self, total_blocks):
+        self.progress_done = 0
+        self.progress_total = total_blocks
+
+    def block_acked(self, block_id):
+        self.last_acked_block = block_id
+        self.progress_done += 1
+        if self.progress is not None:
+            self.progress(self.progress_done, self.progress_total)
+
+    def composite_update(self, segments):
+        '''Flash a list of (packet_id, first_block, image) segments in order
+        over one session, e.g. the boot and system images of a boot upgrade.
+        An image is anything memory_update() takes except a FramedImage.
+
+        The segments share one progress count, and metrics and the ledger
+        see them like any other flash.
+        '''
+        sources = [(packet_id, first_block, ImageSource.wrap(image))
+                for packet_id, first_block, image in segments]
+        self.start_progress(sum((len(source) + 1023) / 1024
+            for packet_id, first_block, source in sources))
+        self.sparse_stats = SparseStats()
+        self.composite = True
+        try:
+            with self.session():
+                for packet_id, first_block, source in sources:
+                    if self.debug: print 'composite_update', len(source), 'bytes to', hex(packet_id), first_block
+                    self.forget_ledger(packet_id)
+                    if not self.flash_source(source, packet_id, first_block):
+                        return False
+        except Exception as e:
+            if self.debug: print "composite_update exception", e
+            return False
+        finally:
+            self.composite = False
+        if self.debug: print 'sparse', self.sparse_stats
+        return True
+
+    def send_retry(self, block, packet_id, block_id):
+        '''send_report() on the open session handle. A failed write is
+        retried up to self.retries times, re-opening the device first
+        '''
+        for attempt in xrange(self.retries + 1):
+            if attempt:
+                if self.debug: print "retrying block", block_id, "attempt", attempt
+                time.sleep(self.retry_delay)
+                try:
+                    self.reopen()
+                except Exception as e:
+                    if self.debug: print "reopen failed", e
+                    continue
+            try:
+                if self.send_report(self.h, block, packet_id, block_id):
+                    return True
+            except Exception as e:
+                if self.debug: print "block", block_id, "write exception", e
+        return False
+
+    def memory_update(self, memory, packet_id, offset=0, first_block=0):
+        '''Flash an in-memory image: a str, bytearray, any other buffer,
+        an ImageSource or a FramedImage'''
+        if isinstance(memory, FramedImage):
+            return self.framed_update(memory)
+        self.forget_ledger(packet_id)
+        return self.flash_source(ImageSource.wrap(memory, offset), packet_id,
+                first_block)
+
     def update(self, file, packet_id, offset=0, first_block=0):
+        with ImageSource.fromfile(file, offset) as source:
+            return self.memory_update(source, packet_id, 0, first_block)
+
+    def framed_update(self, image):
+        '''Replay a FramedImage to the device'''
+        image.check_vid(self.vid)
+        self.start_progress(len(image))
+        self.sparse_stats = SparseStats()
+        self.last_acked_block = None
+        header = header_size(image.vid)
         retval = True
-        with open(file, 'rb') as f:
-            f.seek(offset)
-            h = hid.device()
-            try:
-                h.open(self.vid, self.pid)
-                block_id = first_block
-                while(f and retval):
-                    kb = f.read(1024)
-                    if(len(kb) == 0):
+        try:
+            with self.session():
+                self.forget_ledger(image.packet_id)
+                block_id = image.first_block
+                for block in image.reports:
+                    self.sparse_stats.total_blocks += 1
+                    if is_erased(buffer(block, header)):
+                        self.count_erased(image.packet_id, len(block) - header,
+                                False)
+                    retval = self.send_retry(block, image.packet_id, block_id)
+                    if not retval:
                         break
-                    retval = self.send_kb(h, kb, packet_id, block_id)
+                    self.block_acked(block_id)
                     block_id += 1
-            except Exception as e:
-                if self.debug: print "block write exception", e
-                return False
-            finally:
-                h.close()
-            return retval
+        except:
+            if self.debug: print "block write exception"
+            return False
+        return retval
 
-    def reset(self, reset_id):
-        h = hid.device()
+    def ledger_update(self, memory, packet_id, offset=0, first_block=0,
+            incremental=True):
+        '''Flash memory and record it in the FlashLedger set with set_ledger().
+
+        With incremental set, only the blocks whose hash differs from the
+        ledger entry for this device are sent, and nothing is sent at all if
+        the image is unchanged. With set_sparse(), erased blocks the ledger
+        records as erased on the device are left out even without
+        incremental. This relies on every report erasing and programming
+        only its own block, so that the blocks not sent keep what the ledger
+        says they hold. Without a ledger, or if the device has no serial
+        number to key it on, every block is sent.
+        '''
+        ledger = self.ledger
+        if ledger is None:
+            return self.memory_update(memory, packet_id, offset, first_block)
+        source = ImageSource.wrap(memory, offset)
+        hashes = block_hashes(source, first_block)
         try:
-            h.open(self.vid, self.pid)
-            if self.vid == 0x7722:
-                block = [0]*1089
-                block[1] = reset_id
-                block[4] = reset_id
-            else:
-                block = [0]*1028
-                block[0] = 0x33 #OUTPUT Report ID
-                block[1] = reset_id
-            n = h.write(block)
-            if n == -1:
-                print "reset", hex(reset_id), "failed", reset_id, n
-        finally:
-            time.sleep(2) # Hacky fix for T963
-            h.close()
+            with self.session():
+                serial = self.get_serial()
+                if not serial:
+                    if self.debug: print 'no device serial, flashing every block'
+                    return self.memory_update(source, packet_id, 0, first_block)
+                recorded = ledger.get(serial, packet_id)
+                if incremental:
+                    known = recorded
+                    block_ids = ledger.changed_blocks(serial, packet_id, hashes)
+                else:
+                    known = {}
+                    block_ids = sorted(hashes)
+                if self.sparse:
+                    # Same hash means the device holds this very block
+                    block_ids = [block_id for block_id in block_ids
+                            if recorded.get(block_id) != hashes[block_id] or
+                            not is_erased(source.view(
+                                (block_id - first_block) * 1024, 1024))]
+                if self.debug:
+                    print 'ledger_update', len(block_ids), 'of', len(hashes), 'blocks to', hex(packet_id)
+                if not block_ids:
+                    # Nothing is sent, but the erased blocks are still counted
+                    return self.flash_source(source, packet_id, first_block,
+                            set())
+                ledger.forget(serial, packet_id)
+                if not self.flash_source(source, packet_id, first_block,
+                        set(block_ids)):
+                    return False
+                known.update(hashes)
+                ledger.record(serial, packet_id, known)
+        except:
+            if self.debug: print "block write exception"
+            return False
+        return True
+
+    def frame_image(self, memory, packet_id, offset=0, first_block=0):
+        return FramedImage(self.vid, memory, packet_id, offset, first_block)
+
+    def set_reset_wait(self, poll=True, timeout=5.0, interval=0.05):
+        '''How reset() waits for the device to act on the reset.
+
+        By default HID enumeration is polled every interval seconds until
+        the device drops off or re-enumerates, for at most timeout seconds.
+        With poll off, reset() sleeps for a fixed RESET_DELAY instead.
+        '''
+        self.reset_poll = poll
+        self.reset_timeout = timeout
+        self.reset_interval = interval
+
+    def enumerate_paths(self):
+        with _open_lock:
+            return set(d['path'] for d in self.get_backend().enumerate(self.vid, self.pid))
+
+    def wait_for_reset(self, before):
+        '''Poll until the device is gone from (or has come back to) the
+        enumeration snapshot taken before the reset. Returns False on timeout
+        '''
+        deadline = time.time() + self.reset_timeout
+        while time.time() < deadline:
+            time.sleep(self.reset_interval)
+            try:
+                paths = self.enumerate_paths()
+            except:
+                continue
+            if self.path is not None:
+                if self.path not in paths:
+                    return True
+            elif paths != before:
+                return True
+        if self.debug: print 'no re-enumeration seen after reset'
+        return False
+
+    def reset(self, reset_id):
+        with self.session() as h:
+            waited = False
+            try:
+                before = self.enumerate_paths() if self.reset_poll else None
+                n = h.write(self.framer.frame(None, reset_id, 0))
+                if n == -1:
+                    print "reset", hex(reset_id), "failed", reset_id, n
+                elif self.reset_poll:
+                    self.wait_for_reset(before)
+                    waited = True
+            finally:
+                if not waited:
+                    time.sleep(RESET_DELAY) # Hacky fix for T963
+                # The device re-enumerates, so the handle is no longer usable
+                self.close()
+                self.invalidate_index()
 
     def get_device_versions(self):
-        h = hid.device()
         try:
-            h.open(self.vid, self.pid)
-            versions = h.get_feature_report(0x40, 64)
-            if len(versions) > 12 and versions[0] == 0x40:
-                return DashVersions.fromlist(versions[1:])
+            with self.session() as h:
+                versions = h.get_feature_report(0x40, 64)
+                if len(versions) > 12 and versions[0] == 0x40:
+                    return DashVersions.fromlist(versions[1:])
         except:
             if self.debug: print "get_device_versions exception"
-        finally:
-            h.close()
         return DashVersions()
 
+    def get_serial(self):
+        try:
+            with self.session() as h:
+                return h.get_serial_number_string()
+        except:
+            if self.debug: print "get_serial exception"
+        return None
+
     def device_present(self, vid=None, pid=None):
         if vid is None:
             vid = self.vid
         if pid is None:
             pid = self.pid
+        if self.h is not None and (vid, pid) == (self.vid, self.pid):
+            return True
 
-        h = hid.device()
+        h = self.get_backend().device()
         try:
-            h.open(vid, pid)
+            with _open_lock:
+                h.open(vid, pid)
         except:
             return False
         finally:
@@ -268,6 +778,25 @@ class USBUpdater:
         if self.debug: print 'update_system_memory', len(memory), 'bytes', offset, first_block
         return self.memory_update(memory, 0x3C, offset, first_block)
 
+    def ledger_update_user(self, file, incremental=True):
+        if self.debug: print 'ledger_update_user', file, incremental
+        with ImageSource.fromfile(file) as source:
+            return self.ledger_update(source, 0x18, incremental=incremental)
+
+    def ledger_update_system(self, file, incremental=True):
+        if self.debug: print 'ledger_update_system', file, incremental
+        with ImageSource.fromfile(file) as source:
+            return self.ledger_update(source, 0x3C, incremental=incremental)
+
+    def frame_user(self, file, offset=0, first_block=0):
+        return FramedImage.fromfile(self.vid, file, 0x18, offset, first_block)
+
+    def frame_system(self, file, offset=0, first_block=0):
+        return FramedImage.fromfile(self.vid, file, 0x3C, offset, first_block)
+
+    def frame_system_memory(self, memory, offset=0, first_block=0):
+        return self.frame_image(memory, 0x3C, offset, first_block)
+
     def reset_all(self):
         if self.debug: print 'reset_all'
         self.reset(0xFC)